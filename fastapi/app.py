@@ -1,118 +1,856 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-import requests
+import asyncio
+import logging
+import os
 import shutil
-from pathlib import Path
+import tempfile
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from fastapi import FastAPI, File, Form, Header, UploadFile, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+import io
 import json
 import base64
-from py_utils import ImageDescription, ImageOptimizer
+import py_config
+from py_admission import AdmissionController, Priority, resolve_priority
+from py_cache import NearDuplicateIndex, ResultCache, SingleFlight, make_cache_key
+from py_deadline import check_deadline, request_deadline, run_guarded
+from py_jobs import JobQueue, JobStatus, JobWorkerPool, callback_allowed
+from py_metrics import AppStatsCollector, MetricsMiddleware, count_error, record, record_ollama, timed
+from py_ollama import OllamaClient, OllamaError
+from py_prefilter import SceneFilter
+from py_preprocess import PreparedImage, Preprocessor
+from py_prompts import (FLAGS_PROMPT, FLAGS_PROMPT_VERSION, REPAIR_PROMPT, TILED_PROMPT_VERSION, TILED_PROMPTS, USER_PROMPT,
+                        build_messages, context_size, default_image_tokens, load_system_prompt, tiled_user_prompt)
+from py_router import ModelRouter
+from py_upload import BodySizeLimitMiddleware, validate_image_header
+from py_utils import (BatchItemResult, ImageDescription, ImageOptimizer, MemberTooLarge, SafetyFlags,
+                      StreamingFieldExtractor, TileDescriptions, extract_batch_images, output_schema,
+                      parse_description_text)
+from py_video import FrameSampler, allowed_source, frame_event, iterate_bounded, probe_video, sample_frames, video_available
 
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
 
-# Directory to save uploaded images
-UPLOAD_DIRECTORY = Path("uploaded_images")
-UPLOAD_DIRECTORY.mkdir(exist_ok=True)  # Create the directory if it doesn't exist
+# System prompt of the full analysis (versioned, see py_prompts) - the version goes into the cache key
+PROMPT_VERSION, SYSTEM_PROMPT = load_system_prompt()
 
-OPTIMIZED_DIRECTORY = Path("optimized_uploaded_images")
-OPTIMIZED_DIRECTORY.mkdir(exist_ok=True)  # Create the directory if it doesn't exist
+# Several frames per call (opt-in, see describe_tiles): output budget for a whole tile group
+TILE_MODE = py_config.TILE_MODE
+TILED_NUM_PREDICT = py_config.TILE_NUM_PREDICT * py_config.TILE_SIZE
 
-@app.post("/analyze-image/", response_model=ImageDescription)
-async def analyze_image(file: UploadFile = File(...)):
-    # Validate the uploaded file is an image
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
-    # Save the file temporarily
-    file_path = UPLOAD_DIRECTORY / file.filename
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
+# num_ctx covers the image, the longest prompt and the output; the same value is used for every call,
+# since Ollama reloads the model when num_ctx changes.
+NUM_CTX = py_config.OLLAMA_NUM_CTX or max(
+    context_size((SYSTEM_PROMPT, FLAGS_PROMPT), py_config.DESCRIPTION_NUM_PREDICT),
+    # In multi mode every frame is a separate image in the context
+    context_size((TILED_PROMPTS[TILE_MODE],), TILED_NUM_PREDICT,
+                 default_image_tokens() * (py_config.TILE_SIZE if TILE_MODE == "multi" else 1)) if TILE_MODE != "off" else 0,
+)
+
+OLLAMA_OPTIONS = {
+    "num_ctx": NUM_CTX,     # Tamanho do contexto em tokens - define quanto texto/informação o modelo pode processar de uma vez
+    "num_predict": py_config.DESCRIPTION_NUM_PREDICT,  # Limite de tokens gerados - evita respostas que não terminam
+    "num_thread": 8,        # Número de threads CPU para processamento paralelo - mais threads podem acelerar a inferência
+    "num_gpu": 1,           # Número de GPUs a serem utilizadas - aumentar pode melhorar performance em hardware adequado
+    "temperature": 0.2,     # Controla aleatoriedade das respostas (0-1) - valores menores = respostas mais determinísticas
+    "top_k": 40,            # Limita a seleção aos k tokens mais prováveis - ajuda a manter respostas mais focadas
+    "top_p": 0.9,           # Amostragem nucleus - seleciona tokens cuja prob. acumulada atinge p% - balanceia criatividade/coerência
+}
+
+FLAGS_OPTIONS = {
+    **OLLAMA_OPTIONS,
+    "num_predict": py_config.FLAGS_NUM_PREDICT,  # '{"has_weapon": false, "has_people": false}' cabe em ~20 tokens
+}
+
+# system prompt, prompt version (cache key), output schema and sampling options of each analysis stage
+STAGES = {
+    "full": (SYSTEM_PROMPT, PROMPT_VERSION, ImageDescription, OLLAMA_OPTIONS),
+    "flags": (FLAGS_PROMPT, f"flags-{FLAGS_PROMPT_VERSION}", SafetyFlags, FLAGS_OPTIONS),
+}
+if TILE_MODE != "off":
+    STAGES["tiled"] = (TILED_PROMPTS[TILE_MODE], f"tiled-{TILE_MODE}-{TILED_PROMPT_VERSION}", TileDescriptions,
+                       {**OLLAMA_OPTIONS, "num_predict": TILED_NUM_PREDICT})
+
+
+async def warm_up_model(app: FastAPI):
+    """Loads the model on the Ollama backends, retrying until it is resident, then re-warms on WARMUP_INTERVAL."""
+    while True:
+        try:
+            # Only the preferred model is kept warm; the other routed models load on first use
+            loaded = await app.state.ollama.warm_up(app.state.router.default_model, py_config.OLLAMA_KEEP_ALIVE, {"num_ctx": NUM_CTX})
+        except Exception as e:
+            logger.warning("Warm-up failed: %s", e)
+            loaded = 0
+        if loaded:
+            app.state.model_ready = True
+            if py_config.WARMUP_INTERVAL <= 0:
+                return
+            await asyncio.sleep(py_config.WARMUP_INTERVAL)
+        else:
+            await asyncio.sleep(py_config.WARMUP_RETRY_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cliente HTTP compartilhado - as conexões com o Ollama são reaproveitadas entre requisições
+    app.state.ollama = OllamaClient()
+    await app.state.ollama.start()
+    app.state.router = ModelRouter()
+    app.state.model_ready = not py_config.WARMUP_ENABLED
+    warm_up_task = asyncio.create_task(warm_up_model(app)) if py_config.WARMUP_ENABLED else None
+    app.state.cache = ResultCache() if py_config.CACHE_ENABLED else None
+    app.state.near_duplicates = NearDuplicateIndex() if py_config.NEAR_DUP_ENABLED else None
+    app.state.inflight = SingleFlight() if py_config.COALESCE_ENABLED else None
+    app.state.scene_filter = SceneFilter() if py_config.PREFILTER_ENABLED else None
+    # Shared by all requests - see IMAGE_PRESETS in py_utils
+    app.state.preprocessor = Preprocessor(ImageOptimizer.from_preset(py_config.IMAGE_PRESET, use_grayscale=False))
+    # Limita as chamadas simultâneas dos lotes ao OLLAMA_NUM_PARALLEL do servidor
+    app.state.batch_slots = asyncio.Semaphore(py_config.OLLAMA_NUM_PARALLEL)
+    app.state.admission = AdmissionController()
+    app.state.parse_stats = {'strict': 0, 'recovered': 0, 'repaired': 0, 'failed': 0}
+    app.state.jobs = app.state.job_workers = None
+    if py_config.JOBS_ENABLED:
+        app.state.jobs = JobQueue()
+        app.state.job_workers = JobWorkerPool(
+            app.state.jobs, lambda image, phash: describe_image(app, image, phash, bounded=False, priority=Priority("bulk"))
+        )
+        app.state.job_workers.start()
+    try:
+        yield
+    finally:
+        if warm_up_task is not None:
+            warm_up_task.cancel()
+        if app.state.jobs is not None:
+            await app.state.job_workers.stop()
+            app.state.jobs.close()
+        await app.state.ollama.aclose()
+        if app.state.cache is not None:
+            app.state.cache.close()
+        app.state.preprocessor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(BodySizeLimitMiddleware)
+# Added last so it is the outermost middleware and also times requests refused by the size limit
+app.add_middleware(MetricsMiddleware)
+REGISTRY.register(AppStatsCollector(app))
+
+
+async def decode_description(app: FastAPI, response_text, stage="full", model=None):
+    """Parses the model output of a stage into an ImageDescription (image_context is empty for the flags stage).
+
+    Falls back to the tolerant field extractor and, as a last resort, makes a single text-only repair
+    call to the model. Outcomes are counted in app.state.parse_stats.
+    """
+    logger.debug("Raw response: %s", response_text)
+
+    schema_model = STAGES[stage][2]
     try:
-        prompt = """Analise esta imagem cuidadosamente e forneça uma avaliação detalhada de segurança.
-        Concentre-se especificamente em:
-        1. A presença de pessoas na imagem (mesmo que sejam apenas partes do corpo)
-        2. A presença de armas (armas de fogo, facas ou outros objetos perigosos)
-        3. Contexto geral e potenciais ameaças à segurança
-
-        Responda APENAS com um objeto JSON no seguinte formato:
-        {
-          "image_context": "descrição detalhada da cena em português",
-          "has_weapon": true/false,
-          "has_people": true/false (marque true se QUALQUER presença humana for detectada),
-        }
-
-        Seja especialmente minucioso na detecção de presença humana - mesmo que sejam apenas partes visíveis de uma pessoa.
-        IMPORTANTE: A descrição da cena (image_context) deve estar em português do Brasil."""
-
-        # Optimize the image - reduced grayscale for better detail retention
-        optimizer = ImageOptimizer(max_size=800, quality=90, use_grayscale=False)
-        optimized_image = optimizer.optimize_image(str(file_path))
-        
-        # Read and encode the optimized image in base64
-        with open(optimized_image, "rb") as img_file:
-            image_data = base64.b64encode(img_file.read()).decode('utf-8')
-
-        response = requests.post(
-            "http://ollama:11434/api/chat",
-            json={
-                "model": "llava:7b",
-                "messages": [{
-                    'role': 'user',
-                    'content': prompt,
-                    'images': [image_data]
-                }],
-                "stream": False,
-                "options": {
-                    "num_ctx": 1024,        # Tamanho do contexto em tokens - define quanto texto/informação o modelo pode processar de uma vez
-                    "num_thread": 8,        # Número de threads CPU para processamento paralelo - mais threads podem acelerar a inferência
-                    "num_gpu": 1,           # Número de GPUs a serem utilizadas - aumentar pode melhorar performance em hardware adequado
-                    "temperature": 0.2,     # Controla aleatoriedade das respostas (0-1) - valores menores = respostas mais determinísticas
-                    "top_k": 40,            # Limita a seleção aos k tokens mais prováveis - ajuda a manter respostas mais focadas
-                    "top_p": 0.9,           # Amostragem nucleus - seleciona tokens cuja prob. acumulada atinge p% - balanceia criatividade/coerência
-                }
-            }
+        description, method = parse_description_text(response_text, schema_model)
+    except ValueError:
+        logger.debug("Failed to parse JSON: %s", response_text)
+        description, method = await repair_description(app, response_text, schema_model, model), 'repaired'
+
+    app.state.parse_stats[method] += 1
+    if schema_model is SafetyFlags:
+        return ImageDescription(image_context="", **description.model_dump())
+    return description
+
+
+async def repair_description(app: FastAPI, response_text, schema_model=ImageDescription, model=None):
+    response_json = await app.state.ollama.chat({
+        "model": model or app.state.router.default_model,
+        "messages": [{
+            'role': 'user',
+            'content': REPAIR_PROMPT + response_text,
+        }],
+        "format": output_schema(schema_model),
+        "stream": False,
+        "options": {**OLLAMA_OPTIONS, "temperature": 0, "num_predict": py_config.REPAIR_NUM_PREDICT},
+        "keep_alive": py_config.OLLAMA_KEEP_ALIVE,
+    })
+    try:
+        description, _ = parse_description_text(response_json.get('message', {}).get('content', ''), schema_model)
+        return description
+    except ValueError as e:
+        app.state.parse_stats['failed'] += 1
+        count_error("parse_failed")
+        raise HTTPException(status_code=500, detail=f"Invalid JSON response: {str(e)}")
+
+
+def build_chat_payload(optimized_image, model, stream=False, stage="full", timings=None, user_prompt=USER_PROMPT):
+    """optimized_image is one JPEG or, for the tiled stage in multi mode, a list of them."""
+    prompt, _, schema_model, options = STAGES[stage]
+    images = optimized_image if isinstance(optimized_image, list) else [optimized_image]
+    # Encode the optimized image in base64
+    with timed(timings, "encode"):
+        image_data = [base64.b64encode(image).decode('utf-8') for image in images]
+    return {
+        "model": model,
+        # Fixed system prompt first, so Ollama can reuse the evaluated prefix across requests
+        "messages": build_messages(prompt, image_data, user_prompt),
+        # Schema-constrained decoding - Ollama only samples tokens that keep the output valid for the stage schema
+        "format": output_schema(schema_model),
+        "stream": stream,
+        "options": options,
+        "keep_alive": py_config.OLLAMA_KEEP_ALIVE,
+    }
+
+
+async def lookup_cached(app: FastAPI, optimized_image, model, phash=None, stage="full"):
+    """Checks the exact and near-duplicate caches.
+
+    Returns (cached description or None, keys to pass to store_cached once a fresh result is available).
+    """
+    _, prompt_version, _, options = STAGES[stage]
+    cache_key = scope = None
+    cache = app.state.cache
+    if cache is not None:
+        cache_key = make_cache_key(optimized_image, model, prompt_version, options)
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return cached, None
+
+    near_duplicates = app.state.near_duplicates
+    if near_duplicates is not None and phash is not None:
+        scope = make_cache_key(b"", model, prompt_version, options)
+        cached = near_duplicates.get(scope, phash)
+        if cached is not None:
+            return cached, None
+
+    return None, (cache_key, scope, phash)
+
+
+async def store_cached(app: FastAPI, keys, description):
+    cache_key, scope, phash = keys
+    if cache_key is not None:
+        await app.state.cache.set(cache_key, description)
+    if scope is not None:
+        app.state.near_duplicates.set(scope, phash, description)
+
+
+async def describe_image(app: FastAPI, optimized_image, phash=None, timings=None, bounded=True, stage="full", model=None,
+                         priority=None):
+    """Runs one analysis stage for an already optimized JPEG, going through the result caches first.
+
+    phash is the perceptual hash of the downscaled image, used for the near-duplicate lookup when enabled.
+    timings (dict) accumulates the duration of each stage in seconds (see py_metrics.record);
+    bounded and priority are passed to AdmissionController.slot. model defaults to the router's choice without a budget.
+    """
+    model = model or app.state.router.choose(app.state.ollama)
+    cached, keys = await lookup_cached(app, optimized_image, model, phash, stage)
+    if cached is not None:
+        return cached
+
+    inflight = app.state.inflight
+    if inflight is None:
+        return await run_description(app, optimized_image, keys, timings, bounded, stage, model, priority)
+    # Identical concurrent uploads share one Ollama call; the key is the one the result cache uses plus the
+    # priority class, so a realtime request never waits in the bulk queue behind a flight it joined
+    _, prompt_version, _, options = STAGES[stage]
+    return await inflight.run(
+        (keys[0] or make_cache_key(optimized_image, model, prompt_version, options), priority and priority.name),
+        lambda: run_description(app, optimized_image, keys, timings, bounded, stage, model, priority),
+    )
+
+
+async def run_description(app: FastAPI, optimized_image, keys, timings, bounded, stage, model, priority=None):
+    """The uncached part of describe_image: one Ollama call inside an admission slot, then cache fill."""
+    slot_timings = {}
+    async with app.state.admission.slot(slot_timings, bounded, priority):
+        response_json = await app.state.ollama.chat(build_chat_payload(optimized_image, model, stage=stage, timings=timings))
+        record_ollama(response_json, timings)
+        description = await decode_description(app, response_json.get('message', {}).get('content', ''), stage, model)
+    # Only full-stage calls feed the router, so the latency estimate is comparable across models
+    if stage == "full":
+        app.state.router.observe(model, slot_timings['inference'])
+    for name, seconds in slot_timings.items():
+        record(timings, name, seconds)
+
+    await store_cached(app, keys, description)
+    return description
+
+
+async def describe_image_tiered(app: FastAPI, optimized_image, phash=None, detail="auto", timings=None, model=None, priority=None):
+    """Two-stage cascade: a cheap flags-only call first, the full description only when needed.
+
+    detail="flags" never runs the full stage; detail="auto" runs it only when a flag is true.
+    Returns (description, {stage: seconds}).
+    """
+    stage_timings = {}
+    start = time.perf_counter()
+    flags = await describe_image(app, optimized_image, phash, timings, stage="flags", model=model, priority=priority)
+    stage_timings["flags"] = time.perf_counter() - start
+
+    if detail == "flags" or not (flags.has_weapon or flags.has_people):
+        return flags, stage_timings
+
+    start = time.perf_counter()
+    description = await describe_image(app, optimized_image, phash, timings, stage="full", model=model, priority=priority)
+    stage_timings["full"] = time.perf_counter() - start
+    return description, stage_timings
+
+
+async def describe_tiles(app: FastAPI, frames, phashes, model, priority=None):
+    """Analyzes several optimized frames in a single Ollama call (TILE_MODE): "grid" sends one composite image
+    built by ImageOptimizer.compose_grid, "multi" sends every frame as a separate image of the same message.
+
+    The model answers with one object per tile, mapped back to the frames by index. Returns one
+    ImageDescription per frame, in order; frames left out of the reply are analyzed on their own.
+    """
+    results, keys = [], []
+    for frame, phash in zip(frames, phashes):
+        cached, frame_keys = await lookup_cached(app, frame, model, phash, "tiled")
+        results.append(cached)
+        keys.append(frame_keys)
+    todo = [index for index, result in enumerate(results) if result is None]
+    if not todo:
+        return results
+
+    images = [frames[index] for index in todo]
+    if TILE_MODE == "grid":
+        _, grid = await asyncio.to_thread(app.state.preprocessor.optimizer.compose_grid, images, py_config.TILE_GRID_COLS)
+        images = grid
+
+    slot_timings = {}
+    async with app.state.admission.slot(slot_timings, bounded=False, priority=priority):
+        payload = build_chat_payload(images, model, stage="tiled", user_prompt=tiled_user_prompt(len(todo)))
+        response_json = await app.state.ollama.chat(payload)
+        record_ollama(response_json)
+        tiles = await decode_description(app, response_json.get('message', {}).get('content', ''), "tiled", model)
+    for name, seconds in slot_timings.items():
+        record(None, name, seconds)
+
+    by_tile = {tile.tile: ImageDescription(**tile.model_dump(exclude={"tile"})) for tile in tiles.tiles}
+    for position, index in enumerate(todo):
+        description = by_tile.get(position)
+        if description is None:
+            # A single-frame answer is cached by describe_image under its own (full-stage) key, not the tiled one
+            description = await describe_image(app, frames[index], phashes[index], bounded=False, model=model, priority=priority)
+        else:
+            await store_cached(app, keys[index], description)
+        results[index] = description
+    return results
+
+
+async def stream_description(app: FastAPI, optimized_image, model, phash=None, cached=None, priority=None, deadline=None):
+    """Async generator of NDJSON events for the streaming endpoint.
+
+    Events: "token" (raw text from the model), "field" (a top-level JSON field as soon as it is decoded,
+    so has_weapon/has_people arrive before image_context finishes), "result" (the final ImageDescription)
+    and "error". The Ollama call is aborted when deadline (event loop time) passes; a client disconnect
+    cancels the generator itself.
+    """
+    def event(**data):
+        return json.dumps(data, ensure_ascii=False) + "\n"
+
+    keys = None
+    if cached is None:
+        cached, keys = await lookup_cached(app, optimized_image, model, phash)
+    if cached is not None:
+        for name, value in cached.model_dump().items():
+            yield event(event="field", name=name, value=value)
+        yield event(event="result", data=cached.model_dump(), cached=True)
+        return
+
+    extractor = StreamingFieldExtractor()
+    content = []
+    try:
+        slot_timings = {}
+        async with asyncio.timeout_at(deadline), app.state.admission.slot(slot_timings, priority=priority):
+            async for chunk in app.state.ollama.chat_stream(build_chat_payload(optimized_image, model, stream=True)):
+                token = chunk.get('message', {}).get('content', '')
+                if token:
+                    content.append(token)
+                    yield event(event="token", content=token)
+                    for name, value in extractor.feed(token):
+                        yield event(event="field", name=name, value=value)
+                if chunk.get('done'):
+                    record_ollama(chunk)
+                    break
+            description = await decode_description(app, ''.join(content), model=model)
+
+        app.state.router.observe(model, slot_timings['inference'])
+        await store_cached(app, keys, description)
+        yield event(event="result", data=description.model_dump(), cached=False)
+
+    except HTTPException as e:
+        yield event(event="error", detail=e.detail)
+    except TimeoutError:
+        count_error("deadline_exceeded")
+        yield event(event="error", detail="Deadline exceeded")
+    except Exception as e:
+        count_error("internal")
+        yield event(event="error", detail=str(e))
+
+
+async def optimize_upload(app: FastAPI, source, timings=None):
+    # The upload stream goes straight to the decoder and the JPEG stays in memory - no temp files.
+    # The CPU-bound work runs on the preprocessing pool so it does not block the event loop.
+    with timed(timings, "preprocess"):
+        return await app.state.preprocessor.run(
+            source,
+            with_phash=app.state.near_duplicates is not None,
+            with_thumbnail=app.state.scene_filter is not None,
         )
 
-        # Parse the response - Updated version
+
+def prefiltered(app: FastAPI, prepared: PreparedImage, camera_id=None, detail="full"):
+    """Returns a result without calling the model when the scene pre-filter says there is nothing to analyze.
+
+    A camera's previous result is only reused when it answers the requested detail (see py_prefilter.DETAIL_LEVELS).
+    """
+    if prepared.thumbnail is None:
+        return None
+    return app.state.scene_filter.check(prepared.thumbnail, camera_id, detail)
+
+
+def remember_scene(app: FastAPI, prepared: PreparedImage, camera_id, description, detail="full"):
+    if prepared.thumbnail is not None:
+        app.state.scene_filter.remember(camera_id, prepared.thumbnail, description, detail)
+
+
+@app.post("/analyze-image/", response_model=ImageDescription)
+async def analyze_image(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    detail: Optional[Literal["full", "auto", "flags"]] = Query(None),
+    camera_id: Optional[str] = Header(None, alias="X-Camera-Id"),
+    quality: Optional[Literal["high", "fast"]] = Query(None),
+    latency_budget: Optional[float] = Header(None, alias="X-Latency-Budget"),
+    priority: Optional[Literal["realtime", "interactive", "bulk"]] = Header(None, alias="X-Priority"),
+    api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    request_timeout: Optional[float] = Header(None, alias="X-Request-Timeout", gt=0),
+):
+    """detail=full (default, configurable) runs the full analysis; auto/flags use the two-stage cascade
+    (see describe_image_tiered) and leave image_context empty when the full stage is skipped.
+    The X-Camera-Id header lets the scene pre-filter compare the frame with the camera's previous one.
+    quality and the X-Latency-Budget header (seconds) steer the model choice (see ModelRouter).
+    X-Priority (realtime, interactive, bulk; capped by the X-API-Key class) selects the scheduling class.
+    X-Request-Timeout (seconds) is the client's deadline: queued or in-flight inference is abandoned with 504
+    once it passes, and with 499 as soon as the client disconnects (see run_guarded)."""
+    detail = detail or py_config.ANALYSIS_DETAIL
+    deadline = request_deadline(request_timeout)
+    priority = resolve_priority(priority, api_key, camera_id)
+    # Validate the uploaded file is an image (magic bytes + header only, the content type is not trusted)
+    validate_image_header(file.file)
+    # Reject before doing any work when Ollama is saturated
+    request.app.state.admission.check(priority)
+
+    # Filled by the metrics middleware, which sends it back as the Server-Timing header
+    timings = request.state.timings
+    try:
+        prepared = await optimize_upload(request.app, file.file, timings)
+        skipped = prefiltered(request.app, prepared, camera_id, detail)
+        if skipped is not None:
+            response.headers["X-Prefiltered"] = "true"
+            return skipped
+
+        model = request.app.state.router.choose(request.app.state.ollama, quality, latency_budget)
+        response.headers["X-Model"] = model
+        # Detail level the answer actually covers, remembered with the camera's reference frame
+        answered = "full"
+        if detail == "full":
+            description = await run_guarded(request, describe_image(
+                request.app, prepared.optimized, prepared.phash, timings, model=model, priority=priority
+            ), deadline)
+        else:
+            description, stage_timings = await run_guarded(request, describe_image_tiered(
+                request.app, prepared.optimized, prepared.phash, detail, timings, model, priority
+            ), deadline)
+            response.headers["X-Stage-Timings"] = ", ".join(
+                f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in stage_timings.items()
+            )
+            # A tiered answer that stopped at the flags stage has no image_context and cannot serve a full request
+            if "full" not in stage_timings:
+                answered = detail
+        if "queue" in timings:
+            response.headers["X-Queue-Time"] = f"{timings['queue'] * 1000:.1f}ms"
+            response.headers["X-Inference-Time"] = f"{timings['inference'] * 1000:.1f}ms"
+        remember_scene(request.app, prepared, camera_id, description, answered)
+        return description
+
+    except HTTPException:
+        raise
+    except OllamaError as e:
+        # 503 = no healthy backend (or Ollama overloaded) - let the client retry later
+        raise HTTPException(status_code=503 if e.status_code == 503 else 500, detail=str(e))
+    except Exception as e:
+        count_error("internal")
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+
+@app.post("/analyze-image/stream")
+async def analyze_image_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    camera_id: Optional[str] = Header(None, alias="X-Camera-Id"),
+    quality: Optional[Literal["high", "fast"]] = Query(None),
+    latency_budget: Optional[float] = Header(None, alias="X-Latency-Budget"),
+    priority: Optional[Literal["realtime", "interactive", "bulk"]] = Header(None, alias="X-Priority"),
+    api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    request_timeout: Optional[float] = Header(None, alias="X-Request-Timeout", gt=0),
+):
+    """Streaming variant of /analyze-image/ returning NDJSON events (see stream_description)."""
+    deadline = request_deadline(request_timeout)
+    priority = resolve_priority(priority, api_key, camera_id)
+    validate_image_header(file.file)
+    request.app.state.admission.check(priority)
+
+    try:
+        prepared = await optimize_upload(request.app, file.file, request.state.timings)
+    except Exception as e:
+        count_error("internal")
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+    check_deadline(deadline)
+    model = request.app.state.router.choose(request.app.state.ollama, quality, latency_budget)
+    return StreamingResponse(
+        stream_description(request.app, prepared.optimized, model, prepared.phash, prefiltered(request.app, prepared, camera_id),
+                           priority, deadline),
+        media_type="application/x-ndjson",
+        headers={"X-Model": model},
+    )
+
+
+async def prepare_batch_item(app: FastAPI, data):
+    if isinstance(data, HTTPException):
+        # Upload that could not be read as an image or archive (see analyze_images)
+        raise data
+    validate_image_header(io.BytesIO(data))
+    return await optimize_upload(app, data)
+
+
+async def analyze_batch_item(app: FastAPI, filename, data, priority=None):
+    try:
+        prepared = await prepare_batch_item(app, data)
+        description = prefiltered(app, prepared)
+        if description is None:
+            async with app.state.batch_slots:
+                description = await describe_image(app, prepared.optimized, prepared.phash, bounded=False, priority=priority)
+        return BatchItemResult(filename=filename, result=description)
+    except HTTPException as e:
+        return BatchItemResult(filename=filename, error=str(e.detail))
+    except Exception as e:
+        count_error("internal")
+        return BatchItemResult(filename=filename, error=str(e))
+
+
+async def analyze_batch_tiled(app: FastAPI, items, priority=None):
+    """Batch path of tiling=true: frames are prepared individually, then sent TILE_SIZE at a time (see describe_tiles)."""
+    results = [None] * len(items)
+    pending = []
+
+    async def prepare(index, filename, data):
+        try:
+            prepared = await prepare_batch_item(app, data)
+        except HTTPException as e:
+            results[index] = BatchItemResult(filename=filename, error=str(e.detail))
+            return
+        except Exception as e:
+            count_error("internal")
+            results[index] = BatchItemResult(filename=filename, error=str(e))
+            return
+        description = prefiltered(app, prepared)
+        if description is not None:
+            results[index] = BatchItemResult(filename=filename, result=description)
+        else:
+            pending.append((index, filename, prepared))
+
+    async def analyze(group):
+        try:
+            async with app.state.batch_slots:
+                descriptions = await describe_tiles(
+                    app, [prepared.optimized for _, _, prepared in group], [prepared.phash for _, _, prepared in group], model,
+                    priority,
+                )
+            for (index, filename, _), description in zip(group, descriptions):
+                results[index] = BatchItemResult(filename=filename, result=description)
+        except Exception as e:
+            if not isinstance(e, HTTPException):
+                count_error("internal")
+            error = str(e.detail) if isinstance(e, HTTPException) else str(e)
+            for index, filename, _ in group:
+                results[index] = BatchItemResult(filename=filename, error=error)
+
+    await asyncio.gather(*(prepare(index, filename, data) for index, (filename, data) in enumerate(items)))
+    pending.sort(key=lambda item: item[0])
+    model = app.state.router.choose(app.state.ollama)
+    size = py_config.TILE_SIZE
+    await asyncio.gather(*(analyze(pending[start:start + size]) for start in range(0, len(pending), size)))
+    return results
+
+
+@app.post("/analyze-images/", response_model=List[BatchItemResult])
+async def analyze_images(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    tiling: bool = Query(False),
+    camera_id: Optional[str] = Header(None, alias="X-Camera-Id"),
+    priority: Optional[Literal["realtime", "interactive", "bulk"]] = Header(None, alias="X-Priority"),
+    api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    request_timeout: Optional[float] = Header(None, alias="X-Request-Timeout", gt=0),
+):
+    """Analyzes several images (or zip/tar archives of images) at once.
+
+    Results are returned in input order, with per-image errors instead of failing the whole batch.
+    tiling=true analyzes TILE_SIZE images per model call (TILE_MODE must be grid or multi).
+    Batches are scheduled as bulk unless X-Priority asks otherwise. X-Request-Timeout applies to the whole batch.
+    """
+    deadline = request_deadline(request_timeout)
+    priority = resolve_priority(priority, api_key, camera_id, default="bulk")
+    if tiling and TILE_MODE == "off":
+        raise HTTPException(status_code=400, detail="Tiling is disabled (set TILE_MODE to grid or multi)")
+    items = []
+    for file in files:
+        try:
+            # Reading stops one image past the limit, so an archive with thousands of entries is never fully extracted
+            extracted = await asyncio.to_thread(
+                extract_batch_images, file.filename, file.content_type, file.file,
+                py_config.BATCH_MAX_IMAGES - len(items) + 1, py_config.MAX_UPLOAD_BYTES,
+            )
+        except Exception as e:
+            # Fails only this file's entry, like a corrupt image inside the batch
+            count_error("invalid_image")
+            extracted = [(file.filename, HTTPException(status_code=400, detail=f"Invalid upload: {str(e)}"))]
+        for filename, data in extracted:
+            if isinstance(data, MemberTooLarge):
+                count_error("image_too_large")
+                data = HTTPException(status_code=413, detail=str(data))
+            items.append((filename, data))
+        if len(items) > py_config.BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=400, detail=f"Batch exceeds {py_config.BATCH_MAX_IMAGES} images")
+
+    if tiling:
+        return await run_guarded(request, analyze_batch_tiled(request.app, items, priority), deadline)
+    return await run_guarded(
+        request, asyncio.gather(*(analyze_batch_item(request.app, filename, data, priority) for filename, data in items)), deadline
+    )
+
+
+async def describe_video_frame(app: FastAPI, frame, model, priority=None, camera_id=None):
+    """Runs a sampled video frame through the same path as an uploaded image (ImageOptimizer, pre-filter, caches).
+
+    With camera_id the pre-filter compares the frame to that camera's last analyzed frame, as for X-Camera-Id uploads.
+    """
+    prepared = await optimize_upload(app, frame.image)
+    description = prefiltered(app, prepared, camera_id)
+    if description is not None:
+        return description
+    # Shares the batch slots: a long video does not take more than OLLAMA_NUM_PARALLEL calls
+    async with app.state.batch_slots:
+        description = await describe_image(app, prepared.optimized, prepared.phash, bounded=False, model=model,
+                                           priority=priority)
+    remember_scene(app, prepared, camera_id, description)
+    return description
+
+
+async def video_timeline(app: FastAPI, frames, sampler, model, info, priority=None, upload_path=None, camera_id=None):
+    """Async generator of NDJSON events for /analyze-video/: "video" (metadata), one "frame" per analyzed
+    frame in video order, then "done" with the sampler counters (or "error").
+
+    Up to OLLAMA_NUM_PARALLEL frames are analyzed at once; together with the bounded frame buffer
+    (see iterate_bounded) this caps how far decoding runs ahead of the model.
+    upload_path is the temporary copy of an uploaded video, removed when the timeline ends.
+    """
+    def event(data):
+        return json.dumps(data, ensure_ascii=False) + "\n"
+
+    async def result(frame, task):
         try:
-            response_json = response.json()
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail=f"Error from Ollama API: {response_json}")
-                
-            response_text = response_json.get('message', {}).get('content', '')
-            
-            # Debug logging
-            print("Raw response:", response_text)
-            
-            json_str = response_text.strip()
-            if json_str.startswith('```json'):
-                json_str = json_str[7:-3]  # Remove ```json and ``` if present
-            
-            result = json.loads(json_str)
-            return ImageDescription(**result)
-            
-        except json.JSONDecodeError as e:
-            print("Failed to parse JSON:", response_text)  # Debug logging
-            raise HTTPException(status_code=500, detail=f"Invalid JSON response: {str(e)}")
+            return frame_event(frame, result=(await task).model_dump())
+        except HTTPException as e:
+            return frame_event(frame, error=str(e.detail))
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error processing response: {str(e)}")
-    
+            count_error("internal")
+            return frame_event(frame, error=str(e))
+
+    yield event({"event": "video", **info})
+    pending = deque()
+    try:
+        async for frame in frames:
+            pending.append((frame, asyncio.create_task(describe_video_frame(app, frame, model, priority, camera_id))))
+            if len(pending) >= py_config.OLLAMA_NUM_PARALLEL:
+                yield event(await result(*pending.popleft()))
+        while pending:
+            yield event(await result(*pending.popleft()))
+        yield event({"event": "done", **sampler.stats()})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-    
-    
+        count_error("internal")
+        yield event({"event": "error", "detail": str(e), **sampler.stats()})
     finally:
-        # Cleanup: Remove temporary files
-        if file_path.exists():
-            file_path.unlink()
-        optimized_path = Path(f"optimized_{file_path}")  # Fixed path for optimized image
-        if optimized_path.exists():
-            optimized_path.unlink()
-    
+        # Client gone (or error): stop analyzing the frames still in flight
+        for _, task in pending:
+            task.cancel()
+        if upload_path is not None:
+            os.unlink(upload_path)
+
+
+def copy_upload(fileobj):
+    """Copies an upload to a named temporary file and returns its path (the caller deletes it)."""
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="video-", delete=False) as copy:
+        shutil.copyfileobj(fileobj, copy, 1024 * 1024)
+    return copy.name
+
+
+@app.post("/analyze-video/")
+async def analyze_video(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    source: Optional[str] = Form(None),
+    interval: Optional[float] = Query(None, ge=0),
+    scene_threshold: Optional[float] = Query(None, ge=0),
+    max_frames: Optional[int] = Query(None, ge=0),
+    keyframes_only: Optional[bool] = Query(None),
+    quality: Optional[Literal["high", "fast"]] = Query(None),
+    latency_budget: Optional[float] = Header(None, alias="X-Latency-Budget"),
+    camera_id: Optional[str] = Header(None, alias="X-Camera-Id"),
+    priority: Optional[Literal["realtime", "interactive", "bulk"]] = Header(None, alias="X-Priority"),
+    api_key: Optional[str] = Header(None, alias="X-API-Key"),
+):
+    """Analyzes a video upload (file) or a stream source (source, e.g. rtsp://..., allowed by VIDEO_SOURCE_PREFIXES).
+
+    Frames are sampled every interval seconds or on scene changes above scene_threshold, near-duplicates
+    are dropped, and the timeline is streamed as NDJSON while the video is still being decoded
+    (see video_timeline). Frames are scheduled as bulk unless X-Priority asks otherwise. Requires PyAV.
+    """
+    priority = resolve_priority(priority, api_key, camera_id, default="bulk")
+    if not video_available():
+        raise HTTPException(status_code=501, detail="Video support is not installed (pip install av)")
+    if (file is None) == (source is None):
+        raise HTTPException(status_code=400, detail="Send either a video file or a source")
+    if source is not None:
+        source = allowed_source(source)
+        if source is None:
+            raise HTTPException(status_code=403, detail="Source not allowed (see VIDEO_SOURCE_PREFIXES)")
+
+    upload_path = None
+    if file is not None:
+        # The UploadFile is closed once this handler returns, but the timeline decodes it afterwards
+        upload_path = await asyncio.to_thread(copy_upload, file.file)
+    target = upload_path or source
+    try:
+        info = await asyncio.to_thread(probe_video, target)
+    except ValueError as e:
+        if upload_path is not None:
+            os.unlink(upload_path)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # A live source cannot wait for the model: with the buffer full, new frames are dropped instead
+    live = source is not None and not os.path.isfile(source)
+    sampler = FrameSampler(interval, scene_threshold)
+    frames = iterate_bounded(sample_frames(target, sampler, keyframes_only, max_frames), sampler=sampler, live=live)
+    model = request.app.state.router.choose(request.app.state.ollama, quality, latency_budget)
+    return StreamingResponse(
+        video_timeline(request.app, frames, sampler, model, info, priority, upload_path, camera_id),
+        media_type="application/x-ndjson",
+        headers={"X-Model": model},
+    )
+
+
+def get_job_queue(request: Request):
+    if request.app.state.jobs is None:
+        raise HTTPException(status_code=404, detail="Jobs are disabled")
+    return request.app.state.jobs
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, file: UploadFile = File(...), callback_url: Optional[str] = Form(None)):
+    """Queues an image for background analysis and returns the job id immediately.
+
+    Poll GET /jobs/{job_id} for the result, or pass callback_url to receive the JobStatus by POST
+    (only http(s) URLs under JOBS_CALLBACK_PREFIXES are accepted).
+    """
+    jobs = get_job_queue(request)
+    if callback_url is not None and not callback_allowed(callback_url):
+        raise HTTPException(status_code=422, detail="callback_url not allowed (see JOBS_CALLBACK_PREFIXES)")
+    validate_image_header(file.file)
+
+    try:
+        prepared = await optimize_upload(request.app, file.file, request.state.timings)
+    except Exception as e:
+        count_error("internal")
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+    job_id = await asyncio.to_thread(jobs.enqueue, prepared.optimized, prepared.phash, callback_url)
+    request.app.state.job_workers.notify()
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/stats")
+async def job_stats(request: Request):
+    return await asyncio.to_thread(get_job_queue(request).stats)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(request: Request, job_id: str):
+    status = await asyncio.to_thread(get_job_queue(request).get, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@app.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def readiness(request: Request, response: Response):
+    """Ready only once the model is resident on Ollama and at least one backend is healthy."""
+    ready = request.app.state.model_ready and any(backend.healthy for backend in request.app.state.ollama.backends)
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "starting", "model": request.app.state.router.default_model}
+
+
+@app.get("/backends")
+async def backends(request: Request):
+    return request.app.state.ollama.stats()
+
+
+@app.get("/router/stats")
+async def router_stats(request: Request):
+    """Observed latency and routed request count of each model, and how often the router fell back."""
+    return request.app.state.router.stats()
+
+
+@app.get("/prefilter/stats")
+async def prefilter_stats(request: Request):
+    scene_filter = request.app.state.scene_filter
+    return {"enabled": False} if scene_filter is None else {"enabled": True, **scene_filter.stats()}
+
 
+@app.get("/parse/stats")
+async def parse_stats(request: Request):
+    stats = dict(request.app.state.parse_stats)
+    total = sum(stats.values())
+    stats['parse_failure_rate'] = (total - stats['strict']) / total if total else 0.0
+    return stats
 
 
+@app.get("/admission/stats")
+async def admission_stats(request: Request):
+    return request.app.state.admission.stats()
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, Ollama token rates, cache hit ratios and errors by cause."""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 
+@app.get("/cache/stats")
+async def cache_stats(request: Request):
+    cache = request.app.state.cache
+    near_duplicates = request.app.state.near_duplicates
+    stats = {"enabled": False} if cache is None else {"enabled": True, **cache.stats()}
+    stats["near_duplicates"] = {"enabled": False} if near_duplicates is None else {"enabled": True, **near_duplicates.stats()}
+    inflight = request.app.state.inflight
+    stats["coalescing"] = {"enabled": False} if inflight is None else {"enabled": True, **inflight.stats()}
+    return stats
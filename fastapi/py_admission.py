@@ -0,0 +1,252 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+from fastapi import HTTPException
+import py_config
+from py_metrics import QUEUE_WAIT_SECONDS, count_error
+
+
+# Da mais urgente para a menos urgente: uma vaga livre sempre vai para a classe mais alta com fila
+PRIORITY_CLASSES = ("realtime", "interactive", "bulk")
+
+
+class Priority(NamedTuple):
+    name: str = "interactive"      # classe (PRIORITY_CLASSES)
+    tenant: str = "default"        # dono da requisição (chave de API); define o peso na fila justa
+    flow: str = "default"          # fila justa dentro da classe: tenant + câmera
+
+
+def resolve_priority(requested=None, api_key=None, camera_id=None, default=None):
+    """Classe e fila justa de uma requisição a partir do X-Priority, da chave de API e do X-Camera-Id.
+
+    Com PRIORITY_API_KEYS definido, a chave identifica o tenant e sua classe é o padrão e o teto: o
+    X-Priority só pode pedir uma classe igual ou menos urgente. Uma requisição sem chave fica limitada a
+    PRIORITY_DEFAULT, senão bastaria omitir a chave para furar o teto do tenant.
+    Sem PRIORITY_API_KEYS o X-API-Key é ignorado (pode vir de um gateway na frente da API) e o X-Priority
+    é aceito como veio.
+    """
+    tenant, ceiling = "default", None
+    api_keys = py_config.priority_api_keys()
+    if api_keys:
+        if api_key is None:
+            ceiling = py_config.PRIORITY_DEFAULT
+        else:
+            known = api_keys.get(api_key)
+            if known is None:
+                raise HTTPException(status_code=401, detail="Unknown API key")
+            tenant, ceiling = known
+    name = requested or default or ceiling or py_config.PRIORITY_DEFAULT
+    if ceiling is not None and PRIORITY_CLASSES.index(name) < PRIORITY_CLASSES.index(ceiling):
+        name = ceiling
+    return Priority(name, tenant, f"{tenant}/{camera_id or '-'}")
+
+
+def check_priority_config():
+    """Valida as classes e pesos configurados; chamado na inicialização, para um erro de configuração
+    não virar 500 na primeira requisição que usar a chave."""
+    if py_config.PRIORITY_DEFAULT not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown PRIORITY_DEFAULT: {py_config.PRIORITY_DEFAULT} (expected one of {', '.join(PRIORITY_CLASSES)})")
+    for key, (tenant, name) in py_config.priority_api_keys().items():
+        if name not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown class {name!r} for tenant {tenant!r} in PRIORITY_API_KEYS "
+                             f"(expected one of {', '.join(PRIORITY_CLASSES)})")
+    try:
+        weights = py_config.priority_tenant_weights()
+    except ValueError as e:
+        raise ValueError(f"Invalid PRIORITY_TENANT_WEIGHTS: {e}") from e
+    for tenant, weight in weights.items():
+        if weight <= 0:
+            raise ValueError(f"Invalid PRIORITY_TENANT_WEIGHTS: weight of {tenant!r} must be positive")
+
+
+class AdmissionRejected(HTTPException):
+    """Requisição recusada por sobrecarga (429 fila cheia / 503 espera excedida), com Retry-After."""
+
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class AdmissionController:
+    """Limite de chamadas simultâneas ao Ollama com fila de espera limitada e escalonamento por prioridade.
+
+    Quando a fila está cheia a requisição é recusada imediatamente, em vez de acumular trabalho
+    até que todas as requisições estourem o timeout.
+
+    Uma vaga liberada vai para a classe mais urgente com fila (realtime > interactive > bulk). Dentro da
+    classe, as filas de cada tenant/câmera são atendidas por weighted fair queuing (etiquetas de tempo
+    virtual, peso de PRIORITY_TENANT_WEIGHTS), então uma câmera com muitos frames não atrasa as outras.
+    bulk nunca ocupa mais que bulk_max_in_flight vagas: como a inferência não é interrompida, a vaga
+    reservada garante que um frame realtime não espere uma inferência bulk inteira terminar.
+    """
+
+    def __init__(self, max_in_flight=None, max_queue=None, queue_timeout=None, bulk_max_in_flight=None, tenant_weights=None):
+        check_priority_config()
+        self.max_in_flight = max_in_flight or py_config.ADMISSION_MAX_IN_FLIGHT
+        self.max_queue = max_queue if max_queue is not None else py_config.ADMISSION_MAX_QUEUE
+        self.queue_timeout = queue_timeout or py_config.ADMISSION_QUEUE_TIMEOUT
+        bulk_max_in_flight = bulk_max_in_flight or py_config.PRIORITY_BULK_MAX_IN_FLIGHT or self.max_in_flight - 1
+        self.class_limits = {name: self.max_in_flight for name in PRIORITY_CLASSES}
+        self.class_limits["bulk"] = max(1, min(bulk_max_in_flight, self.max_in_flight))
+        self.tenant_weights = tenant_weights if tenant_weights is not None else py_config.priority_tenant_weights()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.avg_inference_time = 10.0  # Média móvel exponencial, em segundos
+
+        self._running = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._queued = dict.fromkeys(PRIORITY_CLASSES, 0)       # inclui as esperas sem limite (bounded=False)
+        self._waiting = dict.fromkeys(PRIORITY_CLASSES, 0)      # só as esperas limitadas, para check()
+        self._admitted = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._queues = {name: [] for name in PRIORITY_CLASSES}  # heap de (etiqueta, ordem, future)
+        self._virtual_time = dict.fromkeys(PRIORITY_CLASSES, 0.0)
+        self._flow_tags = {}                                    # (classe, flow) -> última etiqueta
+        self._order = itertools.count()
+
+    def is_full(self, priority=None):
+        # waiting também conta quem ainda vai obter a vaga, então a comparação é feita com a capacidade total.
+        # Só a fila das classes tão ou mais urgentes conta: bulk esperando não impede a entrada de realtime.
+        rank = PRIORITY_CLASSES.index(priority.name) if priority is not None else len(PRIORITY_CLASSES) - 1
+        waiting = sum(self._waiting[name] for name in PRIORITY_CLASSES[:rank + 1])
+        return self.in_flight + waiting >= self.max_in_flight + self.max_queue
+
+    def retry_after(self):
+        # Estimativa de quando a fila atual terá sido consumida
+        pending = self.waiting + self.in_flight
+        return max(1, math.ceil(self.avg_inference_time * pending / self.max_in_flight))
+
+    def check(self, priority=None):
+        """Recusa cedo (antes de ler/processar o upload) quando não há espaço na fila."""
+        if self.is_full(priority):
+            self.rejected += 1
+            count_error("queue_full")
+            raise AdmissionRejected(429, "Server busy, queue is full", self.retry_after())
+
+    def _can_start(self, name):
+        return self.in_flight < self.max_in_flight and self._running[name] < self.class_limits[name]
+
+    def _start(self, name):
+        self.in_flight += 1
+        self._running[name] += 1
+
+    def _finish(self, name):
+        self.in_flight -= 1
+        self._running[name] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        for name in PRIORITY_CLASSES:
+            queue = self._queues[name]
+            while queue and self._can_start(name):
+                tag, _, future = heapq.heappop(queue)
+                if future.done():  # desistiu (timeout ou cliente cancelado)
+                    continue
+                self._virtual_time[name] = tag
+                self._start(name)
+                future.set_result(None)
+            if self.in_flight >= self.max_in_flight:
+                return
+
+    def _enqueue(self, priority):
+        """Start-time fair queuing: cada flow avança 1/peso no tempo virtual da classe por requisição."""
+        name = priority.name
+        key = (name, priority.flow)
+        start = max(self._virtual_time[name], self._flow_tags.get(key, 0.0))
+        tag = start + 1.0 / self.tenant_weights.get(priority.tenant, 1.0)
+        self._flow_tags[key] = tag
+        if len(self._flow_tags) > 10000:
+            # Flows sem fila atrás do tempo virtual equivalem a flows novos
+            self._flow_tags = {k: t for k, t in self._flow_tags.items() if t > self._virtual_time[k[0]]}
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues[name], (tag, next(self._order), future))
+        return future
+
+    async def _acquire(self, priority, timeout=None):
+        name = priority.name
+        queued_ahead = any(self._queued[other] for other in PRIORITY_CLASSES[:PRIORITY_CLASSES.index(name) + 1])
+        if not queued_ahead and self._can_start(name):
+            self._start(name)
+            return
+
+        future = self._enqueue(priority)
+        self._queued[name] += 1
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # A vaga chegou junto com o cancelamento: devolve para o próximo da fila
+                self._finish(name)
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._queued[name] -= 1
+
+    @asynccontextmanager
+    async def slot(self, timings=None, bounded=True, priority=None):
+        """Aguarda uma vaga para chamar o Ollama, na fila da classe de priority (padrão PRIORITY_DEFAULT).
+
+        timings (dict) recebe 'queue' e 'inference' em segundos. Com bounded=False (jobs e lotes, que já
+        têm concorrência própria) a espera não é limitada nem recusada.
+        """
+        priority = priority or Priority(py_config.PRIORITY_DEFAULT)
+        name = priority.name
+        start = time.perf_counter()
+        if bounded:
+            self.check(priority)
+            self.waiting += 1
+            self._waiting[name] += 1
+            try:
+                await self._acquire(priority, self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                count_error("queue_timeout")
+                raise AdmissionRejected(503, "Timed out waiting for an inference slot", self.retry_after())
+            finally:
+                self.waiting -= 1
+                self._waiting[name] -= 1
+        else:
+            await self._acquire(priority)
+
+        admitted_at = time.perf_counter()
+        QUEUE_WAIT_SECONDS.labels(name).observe(admitted_at - start)
+        self.admitted += 1
+        self._admitted[name] += 1
+        try:
+            yield
+        finally:
+            self._finish(name)
+            finished_at = time.perf_counter()
+            self.avg_inference_time = 0.8 * self.avg_inference_time + 0.2 * (finished_at - admitted_at)
+            if timings is not None:
+                timings['queue'] = admitted_at - start
+                timings['inference'] = finished_at - admitted_at
+
+    def class_stats(self):
+        return {
+            name: {
+                "in_flight": self._running[name],
+                "queued": self._queued[name],
+                "admitted": self._admitted[name],
+                "max_in_flight": self.class_limits[name],
+            }
+            for name in PRIORITY_CLASSES
+        }
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_inference_time": self.avg_inference_time,
+            "classes": self.class_stats(),
+        }
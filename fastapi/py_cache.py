@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import py_config
+from py_utils import ImageDescription
+
+
+def make_cache_key(image_bytes, model, prompt_version, options):
+    """Chave baseada no conteúdo: hash dos bytes normalizados + modelo + versão do prompt + opções de amostragem."""
+    digest = hashlib.sha256()
+    digest.update(image_bytes)
+    digest.update(b"\0" + model.encode())
+    digest.update(b"\0" + str(prompt_version).encode())
+    digest.update(b"\0" + json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Cache de resultados em dois níveis: LRU em memória (limitado por tamanho/TTL) e SQLite opcional em disco.
+
+    get/set são corrotinas: o nível em memória é consultado no próprio event loop e as leituras e escritas
+    no SQLite rodam numa thread (asyncio.to_thread), para não travar as outras requisições.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, sqlite_path=None):
+        self.max_entries = max_entries if max_entries is not None else py_config.CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else py_config.CACHE_TTL
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (expires_at, ImageDescription)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()  # separado, para o nível em memória não esperar pelo disco
+
+        sqlite_path = sqlite_path if sqlite_path is not None else py_config.CACHE_SQLITE_PATH
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)"
+            )
+            self._db.commit()
+
+    async def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._load, key)
+            if row is not None and row[0] > now:
+                value = ImageDescription.model_validate_json(row[1])
+                with self._lock:
+                    self._remember(key, row[0], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._store, key, expires_at, value.model_dump_json())
+
+    def _load(self, key):
+        with self._db_lock:
+            return self._db.execute("SELECT expires_at, value FROM results WHERE key = ?", (key,)).fetchone()
+
+    def _store(self, key, expires_at, value_json):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, value_json),
+            )
+            self._db.commit()
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+
+class NearDuplicateIndex:
+    """Índice de resultados recentes por hash perceptual (64 bits), com busca por distância de Hamming.
+
+    Usa multi-index hashing: o hash é dividido em (threshold + 1) blocos e, pelo princípio da casa dos pombos,
+    dois hashes com distância <= threshold coincidem exatamente em pelo menos um bloco. Assim a busca só compara
+    os candidatos que compartilham algum bloco, em vez de todas as entradas - rápido mesmo com 100k+ itens.
+    """
+
+    HASH_BITS = 64
+
+    def __init__(self, threshold=None, max_entries=None, ttl=None):
+        self.threshold = threshold if threshold is not None else py_config.NEAR_DUP_THRESHOLD
+        self.max_entries = max_entries if max_entries is not None else py_config.NEAR_DUP_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else py_config.NEAR_DUP_TTL
+        self.hits = 0
+        self.misses = 0
+
+        # Divide os 64 bits em blocos de tamanho o mais uniforme possível
+        chunks = min(self.threshold + 1, self.HASH_BITS)
+        base, extra = divmod(self.HASH_BITS, chunks)
+        self._chunks = []  # (shift, mask)
+        shift = 0
+        for i in range(chunks):
+            width = base + (1 if i < extra else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+
+        self._tables = [{} for _ in self._chunks]  # valor do bloco -> set de chaves
+        self._entries = OrderedDict()  # (scope, phash) -> (expires_at, ImageDescription)
+        self._lock = threading.Lock()
+
+    def _blocks(self, phash):
+        return [(phash >> shift) & mask for shift, mask in self._chunks]
+
+    def get(self, scope, phash):
+        """Retorna o resultado mais próximo com distância <= threshold no mesmo escopo (modelo/prompt), ou None."""
+        now = time.time()
+        with self._lock:
+            best, best_distance = None, self.threshold + 1
+            seen, expired = set(), []
+            for table, block in zip(self._tables, self._blocks(phash)):
+                for key in table.get(block, ()):
+                    if key in seen or key[0] != scope:
+                        continue
+                    seen.add(key)
+                    if self._entries[key][0] <= now:
+                        expired.append(key)
+                        continue
+                    distance = (key[1] ^ phash).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = key, distance
+
+            for key in expired:
+                self._remove(key)
+
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][1]
+
+    def set(self, scope, phash, value):
+        key = (scope, phash)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, value)
+            for table, block in zip(self._tables, self._blocks(phash)):
+                table.setdefault(block, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        del self._entries[key]
+        for table, block in zip(self._tables, self._blocks(key[1])):
+            bucket = table.get(block)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del table[block]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+        }
+
+
+class SingleFlight:
+    """Junta requisições simultâneas com a mesma chave (make_cache_key) numa única chamada ao modelo.
+
+    A primeira requisição inicia a chamada numa task própria; as que chegam enquanto ela está em andamento
+    esperam a mesma task e recebem o mesmo resultado (ou a mesma exceção). Complementa o ResultCache,
+    que só é preenchido quando a chamada termina. A task é cancelada quando não resta ninguém esperando.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights = {}  # key -> [task, requisições esperando]
+
+    async def run(self, key, factory):
+        """factory() cria a coroutine da chamada; só é usada quando não há outra em andamento para key."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = [asyncio.ensure_future(factory()), 0]
+            flight[0].add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not flight[0].done():
+                # Sai do índice antes de cancelar: uma requisição idêntica que chegue antes do callback
+                # começa uma chamada nova em vez de esperar uma task que já foi cancelada
+                self._forget(key, flight)
+                flight[0].cancel()
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+        }
@@ -0,0 +1,204 @@
+import json
+import os
+
+
+def _env_str(name, default):
+    return os.getenv(name, default)
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_duration(name, default):
+    # Ollama aceita keep_alive como duração ("30m", "1h") ou número de segundos (-1 = para sempre)
+    value = os.getenv(name, default)
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Ollama - endpoint e modelo
+OLLAMA_URL = _env_str("OLLAMA_URL", "http://ollama:11434")
+OLLAMA_MODEL = _env_str("OLLAMA_MODEL", "llava:7b")
+OLLAMA_MODELS = _env_str("OLLAMA_MODELS", "")                            # Modelos para roteamento, do mais preciso ao mais rápido (substitui OLLAMA_MODEL)
+
+# Pré-carregamento do modelo (warm-up) e tempo que ele fica residente após cada uso
+OLLAMA_KEEP_ALIVE = _env_duration("OLLAMA_KEEP_ALIVE", "30m")
+WARMUP_ENABLED = _env_bool("WARMUP_ENABLED", True)                        # Carrega o modelo no startup; /health/ready só responde 200 depois disso
+WARMUP_INTERVAL = _env_float("WARMUP_INTERVAL", 0.0)                      # Recarrega o modelo periodicamente (0 = desativado)
+WARMUP_RETRY_INTERVAL = _env_float("WARMUP_RETRY_INTERVAL", 5.0)          # Espera entre tentativas enquanto o modelo não carrega
+
+# Vários servidores Ollama (balanceamento): lista separada por vírgula ou arquivo JSON com a lista de URLs.
+# Quando nenhum dos dois é definido, usa apenas OLLAMA_URL.
+OLLAMA_URLS = _env_str("OLLAMA_URLS", "")
+OLLAMA_BACKENDS_FILE = _env_str("OLLAMA_BACKENDS_FILE", "")
+OLLAMA_HEALTH_INTERVAL = _env_float("OLLAMA_HEALTH_INTERVAL", 10.0)       # Intervalo entre health checks (/api/tags)
+OLLAMA_HEALTH_TIMEOUT = _env_float("OLLAMA_HEALTH_TIMEOUT", 5.0)          # Timeout de cada health check
+OLLAMA_EJECT_AFTER = _env_int("OLLAMA_EJECT_AFTER", 2)                    # Falhas seguidas até remover o backend do pool
+
+
+def ollama_backend_urls():
+    if OLLAMA_BACKENDS_FILE:
+        with open(OLLAMA_BACKENDS_FILE) as f:
+            data = json.load(f)
+        return data["backends"] if isinstance(data, dict) else data
+    if OLLAMA_URLS:
+        return [url.strip() for url in OLLAMA_URLS.split(",") if url.strip()]
+    return [OLLAMA_URL]
+
+
+def ollama_models():
+    if OLLAMA_MODELS:
+        return [model.strip() for model in OLLAMA_MODELS.split(",") if model.strip()]
+    return [OLLAMA_MODEL]
+
+
+# Roteamento entre modelos (ver py_router)
+ROUTER_DEFAULT_QUALITY = _env_str("ROUTER_DEFAULT_QUALITY", "high")       # Tier padrão: high (modelo mais preciso primeiro) ou fast
+ROUTER_LATENCY_SMOOTHING = _env_float("ROUTER_LATENCY_SMOOTHING", 0.2)    # Peso de cada nova medida na média móvel de latência por modelo
+
+# Cliente HTTP compartilhado (pool de conexões)
+OLLAMA_MAX_CONNECTIONS = _env_int("OLLAMA_MAX_CONNECTIONS", 512)          # Conexões simultâneas máximas para o Ollama
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = _env_int("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", 64)  # Conexões ociosas mantidas no pool
+OLLAMA_KEEPALIVE_EXPIRY = _env_float("OLLAMA_KEEPALIVE_EXPIRY", 30.0)     # Segundos até fechar uma conexão ociosa
+OLLAMA_CONNECT_TIMEOUT = _env_float("OLLAMA_CONNECT_TIMEOUT", 5.0)        # Timeout para abrir a conexão
+OLLAMA_READ_TIMEOUT = _env_float("OLLAMA_READ_TIMEOUT", 300.0)            # Timeout de leitura - a inferência pode demorar
+OLLAMA_WRITE_TIMEOUT = _env_float("OLLAMA_WRITE_TIMEOUT", 30.0)           # Timeout para enviar o corpo (imagem em base64)
+OLLAMA_POOL_TIMEOUT = _env_float("OLLAMA_POOL_TIMEOUT", 60.0)             # Tempo máximo esperando uma conexão livre no pool
+
+# Cache de resultados (hash do conteúdo da imagem)
+CACHE_ENABLED = _env_bool("CACHE_ENABLED", True)
+CACHE_MAX_ENTRIES = _env_int("CACHE_MAX_ENTRIES", 1024)                   # Entradas mantidas no LRU em memória
+CACHE_TTL = _env_float("CACHE_TTL", 3600.0)                               # Validade de cada resultado em segundos
+CACHE_SQLITE_PATH = _env_str("CACHE_SQLITE_PATH", "")                     # Caminho do SQLite em disco (vazio = desativado)
+
+# Requisições simultâneas com a mesma imagem e opções esperam uma única chamada ao Ollama
+COALESCE_ENABLED = _env_bool("COALESCE_ENABLED", True)
+
+# Cache de quase-duplicatas (hash perceptual) - útil para frames de câmeras estáticas
+NEAR_DUP_ENABLED = _env_bool("NEAR_DUP_ENABLED", False)
+NEAR_DUP_THRESHOLD = _env_int("NEAR_DUP_THRESHOLD", 4)                    # Distância de Hamming máxima (de 64 bits) para reaproveitar
+NEAR_DUP_MAX_ENTRIES = _env_int("NEAR_DUP_MAX_ENTRIES", 100000)           # Hashes recentes mantidos no índice
+NEAR_DUP_TTL = _env_float("NEAR_DUP_TTL", 60.0)                           # Por quanto tempo um resultado é considerado "recente"
+
+# Lotes (/analyze-images/)
+OLLAMA_NUM_PARALLEL = _env_int("OLLAMA_NUM_PARALLEL", 4)                  # Igual ao OLLAMA_NUM_PARALLEL do servidor Ollama
+BATCH_MAX_IMAGES = _env_int("BATCH_MAX_IMAGES", 100)                      # Máximo de imagens por lote (incluindo as de arquivos zip/tar)
+
+# Vídeo e streams (/analyze-video/, ver py_video): amostragem, deduplicação e buffer entre o decode e o modelo
+VIDEO_SAMPLE_INTERVAL = _env_float("VIDEO_SAMPLE_INTERVAL", 1.0)          # Segundos de vídeo entre frames analisados (0 = só mudanças de cena)
+VIDEO_SCENE_THRESHOLD = _env_float("VIDEO_SCENE_THRESHOLD", 12.0)         # Diferença média (0-255) para o último frame analisado que conta como mudança de cena (0 = desativado)
+VIDEO_DEDUPE = _env_bool("VIDEO_DEDUPE", True)                            # Descarta frames a até NEAR_DUP_THRESHOLD (hash perceptual) do último analisado
+VIDEO_KEYFRAMES_ONLY = _env_bool("VIDEO_KEYFRAMES_ONLY", False)           # Decodifica só os keyframes (bem mais barato, amostragem mais grossa)
+VIDEO_BUFFER_FRAMES = _env_int("VIDEO_BUFFER_FRAMES", 8)                  # Frames amostrados esperando análise antes de segurar o decode
+VIDEO_MAX_FRAMES = _env_int("VIDEO_MAX_FRAMES", 0)                        # Frames analisados por requisição (0 = sem limite)
+VIDEO_SOURCE_PREFIXES = _env_str("VIDEO_SOURCE_PREFIXES", "")             # Prefixos aceitos em source, ex. "rtsp://cameras.local/,/dev/video" (vazio = só upload)
+
+
+def video_source_prefixes():
+    return [prefix.strip() for prefix in VIDEO_SOURCE_PREFIXES.split(",") if prefix.strip()]
+
+
+# Jobs assíncronos (/jobs)
+JOBS_ENABLED = _env_bool("JOBS_ENABLED", True)
+JOBS_SQLITE_PATH = _env_str("JOBS_SQLITE_PATH", "jobs.db")                # Fila persistente local
+JOBS_WORKERS = _env_int("JOBS_WORKERS", OLLAMA_NUM_PARALLEL)              # Workers consumindo a fila
+JOBS_POLL_INTERVAL = _env_float("JOBS_POLL_INTERVAL", 1.0)                # Intervalo de verificação da fila quando ociosa
+JOBS_RETENTION = _env_float("JOBS_RETENTION", 86400.0)                    # Por quanto tempo jobs finalizados ficam disponíveis
+JOBS_LEASE = _env_float("JOBS_LEASE", 60.0)                               # Sem heartbeat por esse tempo, um job 'running' volta a ser entregue
+JOBS_WEBHOOK_TIMEOUT = _env_float("JOBS_WEBHOOK_TIMEOUT", 10.0)           # Timeout do POST para o callback_url
+JOBS_CALLBACK_PREFIXES = _env_str("JOBS_CALLBACK_PREFIXES", "")           # Prefixos aceitos em callback_url, ex. "https://hooks.local/" (vazio = sem webhooks)
+
+
+def jobs_callback_prefixes():
+    return [prefix.strip() for prefix in JOBS_CALLBACK_PREFIXES.split(",") if prefix.strip()]
+
+
+# Controle de admissão (backpressure) na frente do Ollama
+ADMISSION_MAX_IN_FLIGHT = _env_int("ADMISSION_MAX_IN_FLIGHT", OLLAMA_NUM_PARALLEL)  # Chamadas simultâneas ao Ollama
+ADMISSION_MAX_QUEUE = _env_int("ADMISSION_MAX_QUEUE", 32)                 # Requisições aguardando vaga antes de recusar com 429
+ADMISSION_QUEUE_TIMEOUT = _env_float("ADMISSION_QUEUE_TIMEOUT", 30.0)     # Espera máxima por uma vaga antes de recusar com 503
+REQUEST_TIMEOUT = _env_float("REQUEST_TIMEOUT", 0.0)                     # Prazo padrão quando o cliente não envia X-Request-Timeout (0 = sem prazo)
+
+# Classes de prioridade (realtime, interactive, bulk) e fila justa entre tenants/câmeras (ver py_admission)
+PRIORITY_DEFAULT = _env_str("PRIORITY_DEFAULT", "interactive")            # Classe de /analyze-image/ sem X-Priority (lotes, vídeo e jobs usam bulk)
+PRIORITY_BULK_MAX_IN_FLIGHT = _env_int("PRIORITY_BULK_MAX_IN_FLIGHT", 0)  # Vagas que bulk pode ocupar (0 = todas menos uma, reservada às outras classes)
+PRIORITY_API_KEYS = _env_str("PRIORITY_API_KEYS", "")                     # "chave=tenant:classe,..." - a classe da chave é o teto do X-Priority
+PRIORITY_TENANT_WEIGHTS = _env_str("PRIORITY_TENANT_WEIGHTS", "")         # "tenant=peso,..." - fatia de cada tenant dentro da classe (padrão 1)
+
+
+def priority_api_keys():
+    keys = {}
+    for entry in PRIORITY_API_KEYS.split(","):
+        if "=" in entry:
+            key, value = entry.split("=", 1)
+            tenant, _, name = value.partition(":")
+            keys[key.strip()] = (tenant.strip(), name.strip() or PRIORITY_DEFAULT)
+    return keys
+
+
+def priority_tenant_weights():
+    weights = {}
+    for entry in PRIORITY_TENANT_WEIGHTS.split(","):
+        if "=" in entry:
+            tenant, weight = entry.split("=", 1)
+            weights[tenant.strip()] = float(weight)
+    return weights
+
+
+# Reparo da resposta quando o JSON gerado é inválido (uma única tentativa, só texto)
+REPAIR_NUM_PREDICT = _env_int("REPAIR_NUM_PREDICT", 512)                  # Limite de tokens gerados no reparo
+
+# Prompt de sistema e tamanho do contexto (ver py_prompts)
+PROMPT_VARIANT = _env_str("PROMPT_VARIANT", "full")                       # full ou compact (menos tokens de prompt eval)
+PROMPT_FILE = _env_str("PROMPT_FILE", "")                                 # Arquivo com um prompt de sistema próprio (substitui PROMPT_VARIANT)
+IMAGE_TOKENS = _env_int("IMAGE_TOKENS", 0)                                # Tokens que a imagem ocupa no contexto; 0 = derivado do IMAGE_PRESET para o LLaVA 1.6 (anyres, ver py_prompts)
+DESCRIPTION_NUM_PREDICT = _env_int("DESCRIPTION_NUM_PREDICT", 320)        # Limite de tokens gerados na análise completa
+CONTEXT_MARGIN = _env_int("CONTEXT_MARGIN", 64)                           # Folga somada ao contexto derivado (template do chat, erro da estimativa)
+OLLAMA_NUM_CTX = _env_int("OLLAMA_NUM_CTX", 0)                            # 0 = derivado da imagem, do prompt e da saída esperada
+
+# Vários frames por chamada em /analyze-images/?tiling=true (ver TILED_PROMPTS em py_prompts)
+TILE_MODE = _env_str("TILE_MODE", "off")                                  # off, grid (imagem composta) ou multi (várias imagens na mensagem)
+TILE_SIZE = _env_int("TILE_SIZE", 4)                                      # Frames por chamada
+TILE_GRID_COLS = _env_int("TILE_GRID_COLS", 2)                            # Colunas da grade no modo grid
+TILE_NUM_PREDICT = _env_int("TILE_NUM_PREDICT", 120)                      # Tokens gerados por frame (descrições mais curtas)
+
+# Análise em dois estágios (flags primeiro, descrição completa só quando necessário)
+ANALYSIS_DETAIL = _env_str("ANALYSIS_DETAIL", "full")                     # Padrão de /analyze-image/: full, auto ou flags
+FLAGS_NUM_PREDICT = _env_int("FLAGS_NUM_PREDICT", 32)                     # Limite de tokens do estágio de flags
+
+# Pré-filtro local (antes do Ollama) para cenas vazias, escuras, desfocadas ou inalteradas
+PREFILTER_ENABLED = _env_bool("PREFILTER_ENABLED", False)
+PREFILTER_MIN_BRIGHTNESS = _env_float("PREFILTER_MIN_BRIGHTNESS", 10.0)   # Brilho médio (0-255) abaixo do qual a imagem é "escura"
+PREFILTER_MIN_STDDEV = _env_float("PREFILTER_MIN_STDDEV", 4.0)            # Desvio padrão abaixo do qual a imagem é "uniforme"
+PREFILTER_MIN_SHARPNESS = _env_float("PREFILTER_MIN_SHARPNESS", 5.0)      # Variância do Laplaciano abaixo da qual a imagem é "desfocada"
+PREFILTER_BACKGROUND_DIFF = _env_float("PREFILTER_BACKGROUND_DIFF", 2.0)  # Diferença média (0-255) para o último frame da câmera abaixo da qual a cena é "inalterada"
+PREFILTER_MAX_CAMERAS = _env_int("PREFILTER_MAX_CAMERAS", 1000)           # Câmeras com frame de referência em memória
+
+# Pré-processamento da imagem: fast, balanced ou accurate (ver IMAGE_PRESETS em py_utils)
+IMAGE_PRESET = _env_str("IMAGE_PRESET", "balanced")
+
+# Pool de pré-processamento (decode/resize/encode fora do event loop)
+PREPROCESS_EXECUTOR = _env_str("PREPROCESS_EXECUTOR", "thread")           # thread, process ou inline
+PREPROCESS_WORKERS = _env_int("PREPROCESS_WORKERS", 0)                    # 0 = número de CPUs
+
+# Limites de upload (recusados antes de ler/decodificar a imagem inteira)
+MAX_UPLOAD_BYTES = _env_int("MAX_UPLOAD_BYTES", 20 * 1024 * 1024)               # Tamanho máximo do corpo da requisição (uma imagem)
+MAX_BATCH_UPLOAD_BYTES = _env_int("MAX_BATCH_UPLOAD_BYTES", 200 * 1024 * 1024)  # Tamanho máximo do corpo em /analyze-images/
+MAX_VIDEO_UPLOAD_BYTES = _env_int("MAX_VIDEO_UPLOAD_BYTES", 1024 * 1024 * 1024) # Tamanho máximo do corpo em /analyze-video/
+MAX_IMAGE_PIXELS = _env_int("MAX_IMAGE_PIXELS", 40_000_000)                     # Largura x altura máxima (proteção contra decompression bombs)
@@ -0,0 +1,92 @@
+import asyncio
+from fastapi import HTTPException
+import py_config
+from py_metrics import count_error
+
+
+class DeadlineExceeded(HTTPException):
+    """Prazo do cliente (X-Request-Timeout) vencido antes do resultado ficar pronto."""
+
+    def __init__(self):
+        super().__init__(status_code=504, detail="Deadline exceeded")
+
+
+class ClientDisconnected(HTTPException):
+    """O cliente fechou a conexão; 499 como no nginx (a resposta não chega a ser lida)."""
+
+    def __init__(self):
+        super().__init__(status_code=499, detail="Client closed request")
+
+
+def request_deadline(timeout=None):
+    """Converte o X-Request-Timeout (segundos a partir de agora) em prazo absoluto no relógio do event loop.
+
+    Sem header usa REQUEST_TIMEOUT; None = sem prazo. Um tempo relativo evita depender do relógio do cliente.
+    """
+    timeout = timeout if timeout is not None else py_config.REQUEST_TIMEOUT
+    if not timeout or timeout <= 0:
+        return None
+    return asyncio.get_running_loop().time() + timeout
+
+
+def remaining(deadline):
+    """Segundos até o prazo (negativo quando já venceu), ou None sem prazo."""
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
+
+
+def check_deadline(deadline):
+    left = remaining(deadline)
+    if left is not None and left <= 0:
+        count_error("deadline_exceeded")
+        raise DeadlineExceeded()
+
+
+async def wait_for_disconnect(receive):
+    # Depois que o corpo foi lido, o próximo receive() só retorna quando a conexão é fechada
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_guarded(request, coro, deadline=None):
+    """Executa coro numa task que é cancelada quando o cliente desconecta ou o prazo vence.
+
+    O cancelamento chega até a chamada ao Ollama (a conexão HTTP é fechada e o Ollama interrompe a
+    geração) ou, se a chamada ainda está na fila do AdmissionController, tira a requisição da fila.
+    Com o prazo já vencido, coro é descartado sem rodar (corrotina fechada, future cancelado).
+    Deve ser usado depois que o corpo da requisição foi todo lido.
+    """
+    try:
+        check_deadline(deadline)
+    except DeadlineExceeded:
+        # Uma corrotina nunca aguardada gera RuntimeWarning; um future (ex.: asyncio.gather) já tem filhos rodando
+        if asyncio.iscoroutine(coro):
+            coro.close()
+        else:
+            future = asyncio.ensure_future(coro)
+            future.cancel()
+            await asyncio.gather(future, return_exceptions=True)
+        raise
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request.receive))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, timeout=remaining(deadline), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if task in done:
+        return task.result()
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    if watcher in done:
+        count_error("client_disconnected")
+        raise ClientDisconnected()
+    count_error("deadline_exceeded")
+    raise DeadlineExceeded()
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import urlsplit
+import httpx
+from pydantic import BaseModel
+import py_config
+from py_utils import ImageDescription
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str  # queued | running | done | failed
+    result: Optional[ImageDescription] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class JobQueue:
+    """Fila persistente de jobs em SQLite - sobrevive a reinícios sem precisar de um broker externo.
+
+    Pode ser compartilhada por vários processos (uvicorn --workers): o claim é um único UPDATE ... RETURNING,
+    e um job em execução tem um lease renovado por heartbeat. Só jobs cujo lease venceu (processo que caiu)
+    voltam a ser entregues.
+    """
+
+    def __init__(self, path=None):
+        self._db = sqlite3.connect(path or py_config.JOBS_SQLITE_PATH, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    image BLOB,
+                    phash INTEGER,
+                    callback_url TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    lease TEXT,
+                    heartbeat_at REAL
+                )"""
+            )
+            # Filas criadas antes dos leases
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("lease", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._db.commit()
+
+    def enqueue(self, image, phash=None, callback_url=None):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, image, phash, callback_url, created_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                # SQLite só armazena inteiros de 64 bits com sinal
+                (job_id, bytes(image), _to_signed(phash), callback_url, time.time()),
+            )
+            self._db.commit()
+        return job_id
+
+    def claim(self):
+        """Marca o job mais antigo da fila como 'running' e o retorna como (id, lease, image, phash, callback_url).
+
+        Também retoma jobs 'running' cujo heartbeat parou há mais de JOBS_LEASE (o processo que os rodava caiu).
+        Seleção e marcação são um único comando, então dois processos nunca recebem o mesmo job.
+        """
+        lease = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                """UPDATE jobs SET status = 'running', started_at = ?, lease = ?, heartbeat_at = ?
+                   WHERE id = (SELECT id FROM jobs
+                               WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < ?)
+                               ORDER BY created_at LIMIT 1)
+                   RETURNING id, image, phash, callback_url""",
+                (now, lease, now, now - py_config.JOBS_LEASE),
+            ).fetchone()
+            self._db.commit()
+        if row is None:
+            return None
+        return row[0], lease, row[1], _to_unsigned(row[2]), row[3]
+
+    def heartbeat(self, job_id, lease):
+        """Renova o lease; retorna False quando o job foi retomado por outro processo."""
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND lease = ? AND status = 'running'",
+                (time.time(), job_id, lease),
+            ).rowcount
+            self._db.commit()
+        return updated > 0
+
+    def finish(self, job_id, lease, result=None, error=None):
+        """Grava o resultado; ignorado (retorna False) quando o lease já não é deste worker."""
+        # A imagem não é mais necessária depois que o job termina
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, image = NULL, lease = NULL "
+                "WHERE id = ? AND lease = ? AND status = 'running'",
+                ("failed" if error else "done", result.model_dump_json() if result else None, error, time.time(),
+                 job_id, lease),
+            ).rowcount
+            self._db.commit()
+        return updated > 0
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return JobStatus(
+            job_id=row[0],
+            status=row[1],
+            result=ImageDescription.model_validate_json(row[2]) if row[2] else None,
+            error=row[3],
+            created_at=row[4],
+            started_at=row[5],
+            finished_at=row[6],
+        )
+
+    def purge(self, older_than):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (older_than,))
+            self._db.commit()
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._db.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            wait = self._db.execute(
+                "SELECT AVG(started_at - created_at), MAX(started_at - created_at) FROM "
+                "(SELECT started_at, created_at FROM jobs WHERE started_at IS NOT NULL ORDER BY started_at DESC LIMIT 100)"
+            ).fetchone()
+        return {
+            "queue_depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_queued_age": now - oldest if oldest else 0.0,
+            "avg_wait_time": wait[0] or 0.0,   # últimos 100 jobs iniciados
+            "max_wait_time": wait[1] or 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _to_signed(value):
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    if value is None:
+        return None
+    return value + (1 << 64) if value < 0 else value
+
+
+def callback_allowed(url):
+    """O servidor faz o POST para callback_url, então só aceita http(s) com um dos JOBS_CALLBACK_PREFIXES.
+
+    Sem a lista, o cliente poderia apontar o webhook para serviços internos (Ollama, metadados da nuvem...).
+    URLs com usuário/senha são recusadas: "https://hooks.local@outro-host/" começaria com o prefixo.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname or "@" in parts.netloc:
+        return False
+    return any(url.startswith(prefix) for prefix in py_config.jobs_callback_prefixes())
+
+
+class JobWorkerPool:
+    """Pool de tarefas asyncio que consome a fila e chama o Ollama.
+
+    analyze é uma corrotina (image, phash) -> ImageDescription; o resultado é gravado na fila e,
+    se o job tiver callback_url, enviado por POST para o webhook.
+    """
+
+    def __init__(self, queue, analyze, workers=None):
+        self.queue = queue
+        self.analyze = analyze
+        self.workers = workers or py_config.JOBS_WORKERS
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._webhooks = httpx.AsyncClient(timeout=py_config.JOBS_WEBHOOK_TIMEOUT)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                await asyncio.to_thread(self.queue.purge, time.time() - py_config.JOBS_RETENTION)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=py_config.JOBS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, lease, image, phash, callback_url = job
+            result = error = None
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, lease))
+            try:
+                result = await self.analyze(image, phash)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(getattr(e, "detail", e))
+            finally:
+                heartbeat.cancel()
+            finished = await asyncio.to_thread(self.queue.finish, job_id, lease, result, error)
+
+            if finished and callback_url:
+                await self._send_webhook(job_id, callback_url)
+
+    async def _heartbeat(self, job_id, lease):
+        # Renova o lease algumas vezes por período, para uma inferência longa não ser tomada por outro processo
+        while True:
+            await asyncio.sleep(py_config.JOBS_LEASE / 3)
+            if not await asyncio.to_thread(self.queue.heartbeat, job_id, lease):
+                return
+
+    async def _send_webhook(self, job_id, callback_url):
+        status = await asyncio.to_thread(self.queue.get, job_id)
+        try:
+            await self._webhooks.post(callback_url, content=status.model_dump_json(),
+                                      headers={"Content-Type": "application/json"})
+        except httpx.HTTPError as e:
+            logger.warning("Webhook for job %s failed: %s", job_id, e)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._webhooks.aclose()
@@ -0,0 +1,170 @@
+import time
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+# Buckets em segundos: de etapas locais (ms) até inferências longas no CPU
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+STAGE_SECONDS = Histogram(
+    "image_api_stage_seconds",
+    "Duração de cada etapa do processamento de uma imagem",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "image_api_request_seconds",
+    "Duração total das requisições HTTP",
+    ["path", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "image_api_queue_wait_seconds",
+    "Espera por uma vaga no Ollama, por classe de prioridade",
+    ["priority"],
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "image_api_ollama_tokens_per_second",
+    "Velocidade de geração informada pelo Ollama (eval_count / eval_duration)",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250),
+)
+TOKENS = Counter("image_api_ollama_tokens", "Tokens processados pelo Ollama", ["kind"])
+ERRORS = Counter("image_api_errors", "Erros por causa", ["cause"])
+
+# Campos de duração (em nanossegundos) devolvidos pelo Ollama em /api/chat
+OLLAMA_DURATIONS = {
+    "ollama_load": "load_duration",
+    "ollama_prompt_eval": "prompt_eval_duration",
+    "ollama_eval": "eval_duration",
+    "ollama_total": "total_duration",
+}
+
+
+def count_error(cause):
+    ERRORS.labels(cause).inc()
+
+
+def record(timings, stage, seconds):
+    """Registra a duração de uma etapa no histograma e, quando há um dict de timings (Server-Timing), soma nele."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class timed:
+    """Context manager que mede o bloco com record(timings, stage, ...)."""
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.timings, self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def record_ollama(response_json, timings=None):
+    """Registra as durações e contagens de tokens da resposta final do Ollama (stream=False ou chunk com done)."""
+    for stage, field in OLLAMA_DURATIONS.items():
+        if response_json.get(field):
+            record(timings, stage, response_json[field] / 1e9)
+    TOKENS.labels("prompt").inc(response_json.get("prompt_eval_count", 0))
+    TOKENS.labels("eval").inc(response_json.get("eval_count", 0))
+    if response_json.get("eval_count") and response_json.get("eval_duration"):
+        TOKENS_PER_SECOND.observe(response_json["eval_count"] / (response_json["eval_duration"] / 1e9))
+
+
+def server_timing(timings):
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mede a leitura do upload e a duração da requisição, e adiciona o header Server-Timing.
+
+    Os handlers acrescentam etapas em request.state.timings (ver record).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        scope.setdefault("state", {})["timings"] = timings
+        start = time.perf_counter()
+        status = 500
+
+        async def timed_receive():
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False) and "upload" not in timings:
+                record(timings, "upload", time.perf_counter() - start)
+            return message
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"server-timing", server_timing(timings).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, timed_receive, timed_send)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_SECONDS.labels(path, str(status)).observe(time.perf_counter() - start)
+
+
+class AppStatsCollector:
+    """Expõe no /metrics os contadores que já existem em app.state (caches, admissão, parsing), lidos a cada coleta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        state = self.app.state
+        caches = GaugeMetricFamily("image_api_cache_hit_ratio", "Taxa de acertos dos caches", labels=["cache"])
+        lookups = CounterMetricFamily("image_api_cache_lookups", "Consultas aos caches", labels=["cache", "result"])
+        for name, cache in (("exact", getattr(state, "cache", None)), ("near_duplicate", getattr(state, "near_duplicates", None))):
+            if cache is None:
+                continue
+            stats = cache.stats()
+            caches.add_metric([name], stats["hit_ratio"])
+            lookups.add_metric([name, "hit"], stats["hits"])
+            lookups.add_metric([name, "miss"], stats["misses"])
+        yield caches
+        yield lookups
+
+        inflight = getattr(state, "inflight", None)
+        if inflight is not None:
+            yield CounterMetricFamily("image_api_coalesced_requests", "Requisições atendidas por uma chamada idêntica já em andamento",
+                                      value=inflight.coalesced)
+
+        admission = getattr(state, "admission", None)
+        if admission is not None:
+            yield GaugeMetricFamily("image_api_in_flight", "Chamadas ao Ollama em andamento", value=admission.in_flight)
+            yield GaugeMetricFamily("image_api_queue_waiting", "Requisições aguardando vaga", value=admission.waiting)
+            queued = GaugeMetricFamily("image_api_priority_queued", "Chamadas na fila do escalonador, por classe", labels=["priority"])
+            running = GaugeMetricFamily("image_api_priority_in_flight", "Chamadas em andamento, por classe", labels=["priority"])
+            for name, stats in admission.class_stats().items():
+                queued.add_metric([name], stats["queued"])
+                running.add_metric([name], stats["in_flight"])
+            yield queued
+            yield running
+
+        parse_stats = getattr(state, "parse_stats", None)
+        if parse_stats is not None:
+            parsed = CounterMetricFamily("image_api_parse", "Respostas do modelo por forma de parsing", labels=["method"])
+            for method, count in parse_stats.items():
+                parsed.add_metric([method], count)
+            yield parsed
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+import httpx
+import py_config
+from py_metrics import count_error
+
+
+class OllamaError(Exception):
+    """Erro retornado pela API do Ollama (status != 200)."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(f"Error from Ollama API ({status_code}): {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class OllamaBackend:
+    """Estado de um servidor Ollama do pool."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.models = None  # None = ainda não verificado (aceita qualquer modelo)
+        self.outstanding = 0
+        self.failures = 0
+        self.last_check = None
+
+    def has_model(self, model):
+        if self.models is None:
+            return True
+        # "llava" equivale a "llava:latest" no Ollama
+        return model in self.models or (":" not in model and f"{model}:latest" in self.models)
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "models": sorted(self.models) if self.models is not None else None,
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "last_check": self.last_check,
+        }
+
+
+class OllamaClient:
+    """Cliente assíncrono compartilhado para um ou mais servidores Ollama, com pool de conexões.
+
+    Cada chamada vai para o backend saudável, que tem o modelo, com menos requisições pendentes.
+    Um health check periódico em /api/tags remove do pool os backends que falham e os readmite
+    quando voltam a responder.
+
+    Deve ser criado uma única vez no startup da aplicação (start) e fechado no shutdown (aclose).
+    """
+
+    def __init__(self, base_url=None, transport=None, backends=None):
+        urls = backends or ([base_url] if base_url else py_config.ollama_backend_urls())
+        self.backends = [OllamaBackend(url) for url in urls]
+        self._health_task = None
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=py_config.OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=py_config.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=py_config.OLLAMA_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=py_config.OLLAMA_CONNECT_TIMEOUT,
+                read=py_config.OLLAMA_READ_TIMEOUT,
+                write=py_config.OLLAMA_WRITE_TIMEOUT,
+                pool=py_config.OLLAMA_POOL_TIMEOUT,
+            ),
+            transport=transport,
+        )
+
+    async def start(self):
+        await self.check_health()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(py_config.OLLAMA_HEALTH_INTERVAL)
+            await self.check_health()
+
+    async def check_health(self):
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+
+    async def _probe(self, backend):
+        backend.last_check = time.time()
+        try:
+            response = await self._client.get(f"{backend.url}/api/tags", timeout=py_config.OLLAMA_HEALTH_TIMEOUT)
+            response.raise_for_status()
+            backend.models = {model["name"] for model in response.json().get("models", [])}
+            backend.failures = 0
+            backend.healthy = True
+        except (httpx.HTTPError, ValueError):
+            self._mark_failure(backend)
+
+    def _mark_failure(self, backend):
+        backend.failures += 1
+        if backend.failures >= py_config.OLLAMA_EJECT_AFTER:
+            backend.healthy = False
+
+    def _pick(self, model, exclude=()):
+        candidates = [
+            backend for backend in self.backends
+            if backend.healthy and backend.has_model(model) and backend not in exclude
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda backend: backend.outstanding)
+
+    def model_load(self, model):
+        """Requisições pendentes no backend menos ocupado que tem o modelo, ou None se nenhum backend saudável o tem."""
+        backend = self._pick(model)
+        return None if backend is None else backend.outstanding
+
+    @asynccontextmanager
+    async def _route(self, payload, send):
+        """Envia a requisição pelo backend escolhido, tentando o próximo se a conexão falhar."""
+        model = payload.get("model", "")
+        tried = []
+        while True:
+            backend = self._pick(model, tried)
+            if backend is None:
+                count_error("ollama_unavailable")
+                raise OllamaError(503, f"No healthy Ollama backend with model {model}")
+            tried.append(backend)
+            backend.outstanding += 1
+            try:
+                async with AsyncExitStack() as stack:
+                    try:
+                        response = await stack.enter_async_context(send(backend))
+                    except (httpx.ConnectError, httpx.ConnectTimeout):
+                        # Nada chegou ao servidor - é seguro tentar outro backend
+                        self._mark_failure(backend)
+                        continue
+                    yield response
+                    return
+            finally:
+                backend.outstanding -= 1
+
+    async def chat(self, payload):
+        @asynccontextmanager
+        async def send(backend):
+            yield await self._client.post(f"{backend.url}/api/chat", json=payload)
+
+        try:
+            async with self._route(payload, send) as response:
+                if response.status_code != 200:
+                    count_error("ollama_error")
+                    raise OllamaError(response.status_code, response.text)
+                return response.json()
+        except asyncio.CancelledError:
+            # Cliente desconectou ou o prazo venceu: a conexão é fechada e o Ollama interrompe a geração
+            count_error("ollama_aborted")
+            raise
+
+    async def chat_stream(self, payload):
+        """Versão com stream=True de chat: gera cada objeto JSON (linha NDJSON) enviado pelo Ollama."""
+        payload = {**payload, "stream": True}
+
+        def send(backend):
+            return self._client.stream("POST", f"{backend.url}/api/chat", json=payload)
+
+        try:
+            async with self._route(payload, send) as response:
+                if response.status_code != 200:
+                    count_error("ollama_error")
+                    raise OllamaError(response.status_code, (await response.aread()).decode(errors="replace"))
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+        except asyncio.CancelledError:
+            count_error("ollama_aborted")
+            raise
+
+    async def warm_up(self, model, keep_alive, options=None):
+        """Carrega o modelo em todos os backends saudáveis que o possuem (generate sem prompt).
+
+        options deve ter o mesmo num_ctx das análises, senão o Ollama recarrega o modelo na primeira chamada.
+        Retorna quantos backends ficaram com o modelo residente.
+        """
+        payload = {"model": model, "keep_alive": keep_alive}
+        if options:
+            payload["options"] = options
+
+        async def load(backend):
+            try:
+                response = await self._client.post(f"{backend.url}/api/generate", json=payload)
+                return response.status_code == 200
+            except httpx.HTTPError:
+                return False
+
+        backends = [backend for backend in self.backends if backend.healthy and backend.has_model(model)]
+        results = await asyncio.gather(*(load(backend) for backend in backends))
+        return sum(results)
+
+    def stats(self):
+        return [backend.stats() for backend in self.backends]
+
+    async def aclose(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+        await self._client.aclose()
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+import py_config
+from py_utils import ImageDescription
+
+
+# Resultados fixos devolvidos sem chamar o modelo
+NO_ACTIVITY_RESULTS = {
+    "dark": ImageDescription(image_context="Nenhuma atividade: imagem escura demais para análise.", has_weapon=False, has_people=False),
+    "blank": ImageDescription(image_context="Nenhuma atividade: imagem uniforme, sem conteúdo visível.", has_weapon=False, has_people=False),
+    "blurred": ImageDescription(image_context="Nenhuma atividade: imagem desfocada demais para análise.", has_weapon=False, has_people=False),
+}
+
+
+# Nível de análise que um resultado atende, do menor para o maior (parâmetro detail): um resultado só de
+# flags tem image_context vazio e não pode responder a quem pediu a descrição completa
+DETAIL_LEVELS = ("flags", "auto", "full")
+
+THUMBNAIL_SIZE = (96, 96)
+
+
+def scene_thumbnail(img):
+    """Miniatura em tons de cinza (float32) da imagem já reduzida pelo ImageOptimizer."""
+    return np.asarray(img.convert('L').resize(THUMBNAIL_SIZE, Image.Resampling.BILINEAR), dtype=np.float32)
+
+
+class SceneFilter:
+    """Pré-filtro barato (NumPy) que evita chamadas ao LLM para cenas vazias ou sem mudança.
+
+    - brilho médio / desvio padrão: imagens pretas ou uniformes
+    - variância do Laplaciano: imagens muito desfocadas
+    - diferença para o último frame analisado da mesma câmera: cena inalterada reaproveita o último resultado
+
+    Cada limite pode ser desativado com 0.
+    """
+
+    def __init__(self, min_brightness=None, min_stddev=None, min_sharpness=None, background_diff=None, max_cameras=None):
+        self.min_brightness = min_brightness if min_brightness is not None else py_config.PREFILTER_MIN_BRIGHTNESS
+        self.min_stddev = min_stddev if min_stddev is not None else py_config.PREFILTER_MIN_STDDEV
+        self.min_sharpness = min_sharpness if min_sharpness is not None else py_config.PREFILTER_MIN_SHARPNESS
+        self.background_diff = background_diff if background_diff is not None else py_config.PREFILTER_BACKGROUND_DIFF
+        self.max_cameras = max_cameras or py_config.PREFILTER_MAX_CAMERAS
+        self.skipped = {"dark": 0, "blank": 0, "blurred": 0, "unchanged": 0}
+        self.passed = 0
+        self._cameras = OrderedDict()  # camera_id -> (miniatura do último frame analisado, resultado, detail)
+        self._lock = threading.Lock()
+
+    def check(self, thumb, camera_id=None, detail="full"):
+        """Recebe a miniatura de scene_thumbnail; retorna um ImageDescription quando a chamada ao modelo pode ser evitada, senão None.
+
+        O resultado da câmera só é reaproveitado quando atende ao detail pedido (ver DETAIL_LEVELS).
+        """
+        reason = self._classify(thumb)
+        if reason is not None:
+            self.skipped[reason] += 1
+            return NO_ACTIVITY_RESULTS[reason]
+
+        if camera_id and self.background_diff > 0:
+            with self._lock:
+                reference = self._cameras.get(camera_id)
+                if reference is not None:
+                    self._cameras.move_to_end(camera_id)
+            if (reference is not None and DETAIL_LEVELS.index(reference[2]) >= DETAIL_LEVELS.index(detail)
+                    and np.abs(thumb - reference[0]).mean() < self.background_diff):
+                self.skipped["unchanged"] += 1
+                return reference[1]
+
+        self.passed += 1
+        return None
+
+    def _classify(self, thumb):
+        if self.min_brightness > 0 and thumb.mean() < self.min_brightness:
+            return "dark"
+        if self.min_stddev > 0 and thumb.std() < self.min_stddev:
+            return "blank"
+        if self.min_sharpness > 0:
+            laplacian = (thumb[:-2, 1:-1] + thumb[2:, 1:-1] + thumb[1:-1, :-2] + thumb[1:-1, 2:]
+                         - 4 * thumb[1:-1, 1:-1])
+            if laplacian.var() < self.min_sharpness:
+                return "blurred"
+        return None
+
+    def remember(self, camera_id, thumb, description, detail="full"):
+        """Guarda o frame analisado como referência da câmera para as próximas comparações.
+
+        detail é o nível que description atende: "full" quando a descrição completa foi gerada.
+        """
+        if not camera_id:
+            return
+        with self._lock:
+            self._cameras[camera_id] = (thumb, description, detail)
+            self._cameras.move_to_end(camera_id)
+            while len(self._cameras) > self.max_cameras:
+                self._cameras.popitem(last=False)
+
+    def stats(self):
+        return {"passed": self.passed, "skipped": dict(self.skipped), "cameras": len(self._cameras)}
@@ -0,0 +1,64 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, NamedTuple, Optional
+import py_config
+from py_prefilter import scene_thumbnail
+from py_utils import perceptual_hash
+
+
+class PreparedImage(NamedTuple):
+    optimized: Any                   # JPEG bytes sent to Ollama
+    phash: Optional[int] = None      # perceptual hash, when the near-duplicate index is enabled
+    thumbnail: Any = None            # grayscale thumbnail, when the scene pre-filter is enabled
+
+
+def prepare_image_data(optimizer, source, with_phash=False, with_thumbnail=False, as_bytes=False):
+    """Decodifica, reduz e recodifica a imagem (trabalho de CPU). Roda dentro do pool do Preprocessor.
+
+    as_bytes converte o memoryview em bytes, necessário para devolver o resultado de outro processo.
+    """
+    img, optimized = optimizer.process(source)
+    return PreparedImage(
+        optimized=bytes(optimized) if as_bytes else optimized,
+        phash=perceptual_hash(img) if with_phash else None,
+        thumbnail=scene_thumbnail(img) if with_thumbnail else None,
+    )
+
+
+class Preprocessor:
+    """Executa o pré-processamento fora do event loop.
+
+    - "thread": ThreadPoolExecutor - o Pillow libera o GIL durante decode, resize e encode
+    - "process": ProcessPoolExecutor - isolamento total do GIL; a imagem vai e volta como bytes
+    - "inline": no próprio event loop (útil para depuração)
+    """
+
+    def __init__(self, optimizer, kind=None, workers=None):
+        self.optimizer = optimizer
+        self.kind = kind or py_config.PREPROCESS_EXECUTOR
+        workers = workers or py_config.PREPROCESS_WORKERS or os.cpu_count() or 1
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        elif self.kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preprocess")
+        elif self.kind == "inline":
+            self._executor = None
+        else:
+            raise ValueError(f"Unknown PREPROCESS_EXECUTOR: {self.kind}")
+
+    async def run(self, source, with_phash=False, with_thumbnail=False):
+        if self._executor is None:
+            return prepare_image_data(self.optimizer, source, with_phash, with_thumbnail)
+
+        as_bytes = self.kind == "process"
+        if as_bytes and hasattr(source, "read"):
+            # Arquivos abertos não podem ser enviados para outro processo
+            source = source.read()
+        job = partial(prepare_image_data, self.optimizer, source, with_phash, with_thumbnail, as_bytes)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
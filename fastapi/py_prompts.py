@@ -0,0 +1,136 @@
+import hashlib
+import math
+import py_config
+from py_utils import IMAGE_PRESETS
+
+
+# Prompts de sistema da análise completa, por variante: (versão, texto).
+# O texto vai como mensagem "system", idêntico byte a byte em todas as requisições, para que o Ollama
+# reaproveite o KV cache do prefixo (só a imagem muda entre chamadas). Mude a versão ao editar um texto,
+# para que resultados em cache não sejam reaproveitados.
+# As flags vêm primeiro no JSON pedido para que o endpoint de streaming as envie antes do image_context.
+PROMPT_VARIANTS = {
+    "full": (4, """Analise a imagem cuidadosamente e forneça uma avaliação detalhada de segurança.
+Concentre-se especificamente em:
+1. A presença de pessoas na imagem (mesmo que sejam apenas partes do corpo)
+2. A presença de armas (armas de fogo, facas ou outros objetos perigosos)
+3. Contexto geral e potenciais ameaças à segurança
+
+Responda APENAS com um objeto JSON no seguinte formato:
+{
+  "has_weapon": true/false,
+  "has_people": true/false (marque true se QUALQUER presença humana for detectada),
+  "image_context": "descrição detalhada da cena em português"
+}
+
+Seja especialmente minucioso na detecção de presença humana - mesmo que sejam apenas partes visíveis de uma pessoa.
+IMPORTANTE: A descrição da cena (image_context) deve estar em português do Brasil."""),
+    "compact": (1, """Avalie a segurança da imagem. Responda só com JSON:
+{"has_weapon": arma de fogo, faca ou objeto perigoso visível (true/false),
+"has_people": qualquer pessoa ou parte do corpo visível (true/false),
+"image_context": descrição objetiva da cena em português do Brasil}"""),
+}
+
+# Estágio curto da análise em dois estágios (detail=auto/flags): só os dois booleanos
+FLAGS_PROMPT_VERSION = 2
+FLAGS_PROMPT = """Há pessoas (ou partes do corpo) nesta imagem? Há armas (armas de fogo, facas ou objetos perigosos)?
+Responda APENAS com JSON: {"has_weapon": true/false, "has_people": true/false}"""
+
+# Vários frames numa única chamada (TILE_MODE): "grid" = uma imagem composta em grade, "multi" = várias
+# imagens na mesma mensagem. O número de quadros vai na mensagem do usuário, para o prefixo continuar fixo.
+TILED_PROMPT_VERSION = 1
+TILED_PROMPTS = {
+    "grid": """A imagem é uma grade de quadros de câmeras de segurança, separados por linhas pretas e numerados a partir de 0, da esquerda para a direita e de cima para baixo.
+Analise cada quadro separadamente. Responda APENAS com JSON:
+{"tiles": [{"tile": número do quadro, "has_weapon": arma de fogo, faca ou objeto perigoso visível (true/false),
+"has_people": qualquer pessoa ou parte do corpo visível (true/false), "image_context": descrição curta do quadro em português do Brasil}]}
+Inclua um objeto para cada quadro.""",
+    "multi": """Você recebe várias imagens de câmeras de segurança, numeradas a partir de 0 na ordem em que foram enviadas.
+Analise cada imagem separadamente. Responda APENAS com JSON:
+{"tiles": [{"tile": número da imagem, "has_weapon": arma de fogo, faca ou objeto perigoso visível (true/false),
+"has_people": qualquer pessoa ou parte do corpo visível (true/false), "image_context": descrição curta da imagem em português do Brasil}]}
+Inclua um objeto para cada imagem.""",
+}
+
+# Texto fixo da mensagem do usuário, que leva a imagem
+USER_PROMPT = "Imagem:"
+
+REPAIR_PROMPT = """Converta o texto abaixo em um objeto JSON válido seguindo o schema pedido.
+Responda apenas com o JSON.
+
+Texto:
+"""
+
+
+def load_system_prompt(variant=None, path=None):
+    """Retorna (versão, texto) do prompt de sistema: PROMPT_FILE quando definido, senão a variante PROMPT_VARIANT.
+
+    Para um arquivo a versão é derivada do conteúdo, então editar o arquivo invalida o cache sozinho.
+    """
+    path = path if path is not None else py_config.PROMPT_FILE
+    if path:
+        with open(path, encoding="utf-8") as f:
+            text = f.read().strip()
+        return f"file-{hashlib.sha256(text.encode()).hexdigest()[:12]}", text
+    variant = variant or py_config.PROMPT_VARIANT
+    version, text = PROMPT_VARIANTS[variant]
+    return f"{variant}-{version}", text
+
+
+def build_messages(system_prompt, images, user_prompt=USER_PROMPT):
+    """images: lista de imagens em base64."""
+    return [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt, 'images': images},
+    ]
+
+
+def tiled_user_prompt(count):
+    return f"Quadros: {count}"
+
+
+def estimate_tokens(text):
+    # Estimativa conservadora: ~3 bytes UTF-8 por token em português (acentos ocupam 2 bytes)
+    return math.ceil(len(text.encode("utf-8")) / 3)
+
+
+# LLaVA 1.6 (llava:7b) usa "anyres": a imagem é encaixada na grade de tiles de 336px que melhor a comporta e cada
+# tile, mais uma cópia da imagem inteira reduzida a 336px, ocupa 576 tokens do CLIP. Com o preset balanced (672px)
+# uma imagem quadrada vira 2x2 tiles + base = 2880 tokens; os 576 de uma única imagem 336px são do LLaVA 1.5.
+CLIP_TILE = 336
+CLIP_TILE_TOKENS = 576
+ANYRES_GRIDS = ((1, 2), (2, 1), (2, 2), (3, 1), (1, 3))  # (colunas, linhas) aceitas pelo modelo
+
+
+def anyres_image_tokens(width, height):
+    """Tokens de uma imagem width x height no LLaVA 1.6.
+
+    A grade é escolhida como no modelo: maior resolução efetiva e, no empate, menos área desperdiçada.
+    """
+    def fit(grid):
+        grid_w, grid_h = grid[0] * CLIP_TILE, grid[1] * CLIP_TILE
+        scale = min(grid_w / width, grid_h / height)
+        effective = min(int(width * scale) * int(height * scale), width * height)
+        return effective, effective - grid_w * grid_h
+
+    cols, rows = max(ANYRES_GRIDS, key=fit)
+    return (cols * rows + 1) * CLIP_TILE_TOKENS
+
+
+def default_image_tokens():
+    """IMAGE_TOKENS, ou o custo de uma imagem quadrada (o pior caso) no tamanho máximo de IMAGE_PRESET no LLaVA 1.6."""
+    if py_config.IMAGE_TOKENS:
+        return py_config.IMAGE_TOKENS
+    max_size = IMAGE_PRESETS[py_config.IMAGE_PRESET]["max_size"]
+    return anyres_image_tokens(max_size, max_size)
+
+
+def context_size(prompts, num_predict, image_tokens=None):
+    """num_ctx suficiente para a imagem, o maior dos prompts e a saída, arredondado para múltiplos de 128.
+
+    Um único valor para todos os estágios: o Ollama recarrega o modelo quando num_ctx muda entre chamadas.
+    """
+    image_tokens = image_tokens or default_image_tokens()
+    prompt_tokens = max(estimate_tokens(prompt + USER_PROMPT) for prompt in prompts)
+    needed = image_tokens + prompt_tokens + num_predict + py_config.CONTEXT_MARGIN
+    return math.ceil(needed / 128) * 128
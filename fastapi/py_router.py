@@ -0,0 +1,81 @@
+import threading
+import py_config
+
+
+class ModelRouter:
+    """Escolhe o modelo de cada requisição entre OLLAMA_MODELS (do mais preciso ao mais rápido).
+
+    A estimativa de latência de um modelo é a média móvel das inferências observadas multiplicada pela fila
+    no backend menos ocupado que o tem (outstanding / OLLAMA_NUM_PARALLEL). A ordem de preferência vem do
+    tier de qualidade (high = mais preciso primeiro, fast = mais rápido primeiro); é escolhido o primeiro
+    modelo disponível que cabe no orçamento de latência (ou, sem orçamento, que não está sobrecarregado).
+    Se nenhum couber, cai para o de menor latência estimada.
+
+    Modelos ainda sem medições são considerados dentro do orçamento, para que passem a ser medidos.
+    """
+
+    QUALITIES = ("high", "fast")
+
+    def __init__(self, models=None, parallel=None, smoothing=None):
+        self.models = list(models or py_config.ollama_models())
+        self.parallel = parallel or py_config.OLLAMA_NUM_PARALLEL
+        self.smoothing = smoothing or py_config.ROUTER_LATENCY_SMOOTHING
+        self.latency = {model: None for model in self.models}  # Média móvel da inferência, em segundos
+        self.routed = {model: 0 for model in self.models}
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    @property
+    def default_model(self):
+        return self.models[0]
+
+    def estimate(self, model, outstanding):
+        latency = self.latency[model]
+        if latency is None:
+            return None
+        return latency * (1 + outstanding / self.parallel)
+
+    def choose(self, ollama, quality=None, latency_budget=None):
+        quality = quality or py_config.ROUTER_DEFAULT_QUALITY
+        preference = self.models if quality != "fast" else list(reversed(self.models))
+        candidates = []
+        for model in preference:
+            outstanding = ollama.model_load(model)
+            if outstanding is not None:
+                candidates.append((model, outstanding, self.estimate(model, outstanding)))
+        if not candidates:
+            # Nenhum backend saudável - o cliente do Ollama devolve o erro 503
+            return preference[0]
+
+        for model, outstanding, estimate in candidates:
+            if latency_budget is not None:
+                fits = estimate is None or estimate <= latency_budget
+            else:
+                fits = outstanding < self.parallel
+            if fits:
+                self._count(model, fallback=model != preference[0])
+                return model
+
+        model = min(candidates, key=lambda candidate: candidate[2] or 0.0)[0]
+        self._count(model, fallback=model != preference[0])
+        return model
+
+    def _count(self, model, fallback):
+        with self._lock:
+            self.routed[model] += 1
+            if fallback:
+                self.fallbacks += 1
+
+    def observe(self, model, seconds):
+        with self._lock:
+            previous = self.latency.get(model)
+            self.latency[model] = seconds if previous is None else (1 - self.smoothing) * previous + self.smoothing * seconds
+
+    def stats(self):
+        return {
+            "models": [
+                {"model": model, "avg_latency": self.latency[model], "routed": self.routed[model]}
+                for model in self.models
+            ],
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,132 @@
+import warnings
+from PIL import Image
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+import py_config
+from py_metrics import count_error
+
+# O próprio Pillow recusa (DecompressionBombError) imagens com mais do que o dobro deste limite ao abrir
+Image.MAX_IMAGE_PIXELS = py_config.MAX_IMAGE_PIXELS
+
+# Assinaturas (magic bytes) dos formatos aceitos
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+]
+
+
+def sniff_image_format(head):
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def validate_image_header(fileobj):
+    """Valida a imagem lendo só o cabeçalho: formato pelos magic bytes e dimensões pelo Pillow (que não decodifica
+    os pixels em Image.open). Rejeita arquivos que não são imagem (400) e imagens gigantes / decompression bombs (413).
+
+    Retorna (formato, (largura, altura)) e deixa o arquivo posicionado no início.
+    """
+    start = fileobj.tell()
+    head = fileobj.read(16)
+    fileobj.seek(start)
+    if sniff_image_format(head) is None:
+        count_error("invalid_image")
+        raise HTTPException(status_code=400, detail="File must be an image (JPEG, PNG, GIF, BMP, TIFF or WEBP)")
+
+    try:
+        with warnings.catch_warnings():
+            # O limite de pixels é verificado abaixo, com uma mensagem própria
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(fileobj) as img:
+                image_format, size = img.format, img.size
+    except Image.DecompressionBombError:
+        count_error("image_too_large")
+        raise HTTPException(status_code=413, detail="Image dimensions are too large")
+    except Exception:
+        count_error("invalid_image")
+        raise HTTPException(status_code=400, detail="Invalid or corrupted image")
+    finally:
+        fileobj.seek(start)
+
+    if size[0] * size[1] > py_config.MAX_IMAGE_PIXELS:
+        count_error("image_too_large")
+        raise HTTPException(status_code=413, detail=f"Image has more than {py_config.MAX_IMAGE_PIXELS} pixels")
+    return image_format, size
+
+
+class BodyTooLarge(HTTPException):
+    """Corpo maior que o limite; é HTTPException para atravessar o parser de formulários do FastAPI sem virar 400."""
+
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Request body exceeds {limit} bytes")
+
+
+class BodySizeLimitMiddleware:
+    """Middleware ASGI que limita o tamanho do corpo da requisição enquanto ele é recebido.
+
+    Recusa com 413 pelo Content-Length antes de ler qualquer byte e, sem Content-Length (chunked),
+    assim que o limite é ultrapassado - o upload não chega a ser todo armazenado.
+    """
+
+    def __init__(self, app, max_bytes=None, max_batch_bytes=None, max_video_bytes=None):
+        self.app = app
+        self.max_bytes = max_bytes or py_config.MAX_UPLOAD_BYTES
+        self.max_batch_bytes = max_batch_bytes or py_config.MAX_BATCH_UPLOAD_BYTES
+        self.max_video_bytes = max_video_bytes or py_config.MAX_VIDEO_UPLOAD_BYTES
+
+    def _limit(self, path):
+        if path.startswith("/analyze-images"):
+            return self.max_batch_bytes
+        if path.startswith("/analyze-video"):
+            return self.max_video_bytes
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self._limit(scope["path"])
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                count_error("body_too_large")
+                await self._reject(scope, receive, send, limit)
+                return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    count_error("body_too_large")
+                    raise BodyTooLarge(limit)
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except BodyTooLarge:
+            if not response_started:
+                await self._reject(scope, receive, send, limit)
+
+    async def _reject(self, scope, receive, send, limit):
+        response = JSONResponse({"detail": f"Request body exceeds {limit} bytes"}, status_code=413)
+        await response(scope, receive, send)
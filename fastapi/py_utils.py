@@ -1,3 +1,12 @@
+import itertools
+import json
+import math
+import tarfile
+import zipfile
+from io import BytesIO
+from pathlib import PurePosixPath
+from typing import List, Optional
+import numpy as np
 from pydantic import BaseModel
 from PIL import Image
 
@@ -7,15 +16,88 @@ class ImageDescription(BaseModel):
     has_people: bool
     #confidence: int
 
+class SafetyFlags(BaseModel):
+    has_weapon: bool
+    has_people: bool
+
+class TileDescription(ImageDescription):
+    tile: int
+
+class TileDescriptions(BaseModel):
+    tiles: List[TileDescription]
+
+# O Ollama gera as propriedades na ordem do schema em "format": as flags vêm antes do image_context,
+# para o stream entregar has_weapon/has_people sem esperar a descrição inteira (tile primeiro no modo tiled)
+FLAGS_FIRST = ('tile', 'has_weapon', 'has_people')
+
+
+def output_schema(model):
+    """JSON schema de model para o "format" do Ollama, com FLAGS_FIRST no início de cada objeto.
+
+    O modelo pydantic (e a resposta da API) continua com a ordem declarada.
+    """
+    def reorder(schema):
+        if 'properties' in schema:
+            properties = schema['properties']
+            first = [key for key in FLAGS_FIRST if key in properties]
+            schema['properties'] = {key: properties[key] for key in first + [key for key in properties if key not in first]}
+            if 'required' in schema:
+                schema['required'] = [key for key in schema['properties'] if key in schema['required']]
+        for definition in schema.get('$defs', {}).values():
+            reorder(definition)
+        return schema
+
+    return reorder(model.model_json_schema())
+
+
+class BatchItemResult(BaseModel):
+    filename: str
+    result: Optional[ImageDescription] = None
+    error: Optional[str] = None
+
+# Presets de pré-processamento. O encoder de visão do LLaVA trabalha em tiles de 336px (o LLaVA 1.6 monta grades de
+# até 672px, ao custo de até 5x os tokens de imagem - ver py_prompts), então resoluções maiores só aumentam o custo
+# de decode/encode e o tamanho do payload.
+IMAGE_PRESETS = {
+    'fast': dict(max_size=336, quality=80, resample=Image.Resampling.BILINEAR, fast_decode=True,
+                 optimize=False, progressive=False, passthrough_max_bytes=64 * 1024),
+    'balanced': dict(max_size=672, quality=85, resample=Image.Resampling.BICUBIC, fast_decode=True,
+                     optimize=False, progressive=False, passthrough_max_bytes=256 * 1024),
+    'accurate': dict(max_size=800, quality=90, resample=Image.Resampling.LANCZOS, fast_decode=False,
+                     optimize=False, progressive=False, passthrough_max_bytes=0),
+}
+
 class ImageOptimizer:
-    def __init__(self, max_size=800, quality=90, use_grayscale=False):
+    def __init__(self, max_size=800, quality=90, use_grayscale=False, resample=Image.Resampling.LANCZOS,
+                 fast_decode=False, optimize=True, progressive=True, passthrough_max_bytes=0):
         self.max_size = max_size
         self.quality = quality
         self.use_grayscale = use_grayscale
+        self.resample = resample
+        self.fast_decode = fast_decode                      # draft() do JPEG e reduce() antes do resize
+        self.optimize = optimize                            # Passes extras do encoder JPEG (lentos, só reduzem bytes)
+        self.progressive = progressive
+        self.passthrough_max_bytes = passthrough_max_bytes  # Envia o JPEG original se já for pequeno (0 = nunca)
 
-    def optimize_image(self, image_path):
-        # Abre e otimiza a imagem
-        img = Image.open(image_path)
+    @classmethod
+    def from_preset(cls, name, **overrides):
+        return cls(**{**IMAGE_PRESETS[name], **overrides})
+
+    def _open(self, source):
+        if isinstance(source, Image.Image):  # Frame já decodificado (ex.: vídeo)
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = BytesIO(source)
+        return Image.open(source)
+
+    def _target_size(self, size):
+        ratio = self.max_size / max(size)
+        return tuple([int(x * ratio) for x in size])
+
+    def _transform(self, img):
+        # Decodifica o JPEG já em escala reduzida (1/2, 1/4 ou 1/8) - muito mais barato que decodificar tudo e reduzir depois
+        if self.fast_decode and img.format == 'JPEG' and max(img.size) > self.max_size:
+            img.draft('L' if self.use_grayscale else 'RGB', self._target_size(img.size))
 
         # Converte para escala de cinza se configurado
         if self.use_grayscale and img.mode in ('RGB', 'RGBA'):
@@ -25,16 +107,258 @@ class ImageOptimizer:
 
         # Redimensiona se necessário, mantendo a proporção
         if max(img.size) > self.max_size:
-            ratio = self.max_size / max(img.size)
-            new_size = tuple([int(x * ratio) for x in img.size])
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
+            # reducing_gap faz um reduce() inteiro antes do filtro final
+            img = img.resize(self._target_size(img.size), self.resample,
+                             reducing_gap=2.0 if self.fast_decode else None)
+
+        return img
+
+    def prepare_image(self, source):
+        """Abre a imagem (caminho, bytes, objeto file-like ou imagem PIL) e aplica conversão de cor e redimensionamento."""
+        return self._transform(self._open(source))
+
+    def process(self, source):
+        """Retorna (imagem reduzida, bytes do JPEG a enviar ao modelo).
+
+        Quando o original já é um JPEG pequeno o suficiente (passthrough_max_bytes), seus bytes são enviados
+        sem recodificação.
+        """
+        if not self.passthrough_max_bytes or isinstance(source, Image.Image):
+            img = self.prepare_image(source)
+            return img, self.encode_bytes(img)
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = bytes(source)
+        elif hasattr(source, 'read'):
+            data = source.read()
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+
+        img = self._open(data)
+        passthrough = (
+            img.format == 'JPEG'
+            and len(data) <= self.passthrough_max_bytes
+            and max(img.size) <= self.max_size
+            and img.mode == ('L' if self.use_grayscale else 'RGB')
+        )
+        img = self._transform(img)
+        return img, (memoryview(data) if passthrough else self.encode_bytes(img))
+
+    def encode_image(self, img, buffer):
+        img.save(buffer,
+                format='JPEG',
+                quality=self.quality,
+                optimize=self.optimize,
+                progressive=self.progressive)
+
+    def encode_bytes(self, img):
+        buffer = BytesIO()
+        self.encode_image(img, buffer)
+        return buffer.getbuffer()
+
+    def optimize_bytes(self, source):
+        """Versão em memória de optimize_image: recebe bytes/file-like e devolve o JPEG como memoryview, sem arquivos temporários."""
+        return self.encode_bytes(self.prepare_image(source))
+
+    def compose_grid(self, sources, cols=2, gap=4):
+        """Monta uma grade com várias imagens para analisá-las numa única chamada; retorna (grade, bytes do JPEG).
+
+        Cada imagem é reduzida para caber numa célula de max_size // cols pixels; as células seguem a ordem
+        das imagens, da esquerda para a direita e de cima para baixo, separadas por gap pixels pretos.
+        """
+        cell = (self.max_size - gap * (cols - 1)) // cols
+        rows = math.ceil(len(sources) / cols)
+        grid = Image.new('L' if self.use_grayscale else 'RGB', (cols * cell + (cols - 1) * gap, rows * cell + (rows - 1) * gap))
+        for index, source in enumerate(sources):
+            img = self.prepare_image(source)
+            img.thumbnail((cell, cell), self.resample)
+            x = (index % cols) * (cell + gap) + (cell - img.width) // 2
+            y = (index // cols) * (cell + gap) + (cell - img.height) // 2
+            grid.paste(img, (x, y))
+        return grid, self.encode_bytes(grid)
+
+    def optimize_image(self, image_path):
+        # Abre e otimiza a imagem
+        img = self.prepare_image(image_path)
 
         # Salva a imagem otimizada
         optimized_path = 'optimized_' + image_path
-        img.save(optimized_path, 
-                format='JPEG', 
-                quality=self.quality, 
-                optimize=True,
-                progressive=True)
+        self.encode_image(img, optimized_path)
 
         return optimized_path
+
+
+def perceptual_hash(img, hash_size=8):
+    """dHash de 64 bits: compara pixels vizinhos de uma miniatura em tons de cinza.
+
+    Robusto a ruído de sensor e artefatos de JPEG - frames quase idênticos geram hashes com pequena distância de Hamming.
+    """
+    thumb = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class StreamingFieldExtractor:
+    """Parser JSON incremental que emite os campos escalares do objeto de nível superior assim que são decodificados.
+
+    Permite enviar has_weapon/has_people ao cliente antes do modelo terminar de gerar o image_context.
+    Texto antes do primeiro '{' (ex.: ```json) é ignorado.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.buffer = []
+        self.literal = []
+        self.key = None
+        self.expecting_value = False
+        self.fields = {}
+
+    def feed(self, text):
+        """Consome um pedaço do texto gerado e retorna a lista de (campo, valor) completados nele."""
+        completed = []
+        for ch in text:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    self.buffer.append(ch)
+                elif ch == '\\':
+                    self.escape = True
+                    self.buffer.append(ch)
+                elif ch == '"':
+                    self.in_string = False
+                    self._end_string(completed)
+                else:
+                    self.buffer.append(ch)
+            elif ch == '"':
+                self.in_string = True
+                self.buffer = []
+            elif ch in '{[':
+                self._end_literal(completed)
+                self.depth += 1
+                if self.depth > 1:
+                    self.expecting_value = False
+            elif ch in '}]':
+                self._end_literal(completed)
+                self.depth = max(self.depth - 1, 0)
+            elif self.depth == 1 and ch == ':':
+                self.expecting_value = True
+            elif self.depth == 1 and ch == ',':
+                self._end_literal(completed)
+                self.key = None
+                self.expecting_value = False
+            elif ch.isspace():
+                self._end_literal(completed)
+            elif self.depth == 1 and self.expecting_value:
+                self.literal.append(ch)
+                # true/false podem ser emitidos sem esperar o delimitador seguinte
+                if ''.join(self.literal) in ('true', 'false'):
+                    self._end_literal(completed)
+        return completed
+
+    def _end_string(self, completed):
+        if self.depth != 1:
+            return
+        try:
+            value = json.loads('"' + ''.join(self.buffer) + '"')
+        except json.JSONDecodeError:
+            value = ''.join(self.buffer)
+        if self.expecting_value and self.key is not None:
+            self._emit(self.key, value, completed)
+        else:
+            self.key = value
+
+    def _end_literal(self, completed):
+        if not self.literal:
+            return
+        raw = ''.join(self.literal)
+        self.literal = []
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        if self.key is not None:
+            self._emit(self.key, value, completed)
+
+    def _emit(self, key, value, completed):
+        self.expecting_value = False
+        self.fields[key] = value
+        completed.append((key, value))
+
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff'}
+ZIP_CONTENT_TYPES = {'application/zip', 'application/x-zip-compressed'}
+TAR_CONTENT_TYPES = {'application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-gtar'}
+
+
+def _is_archive_image(name):
+    path = PurePosixPath(name)
+    if any(part.startswith(('.', '__MACOSX')) for part in path.parts):
+        return False
+    return path.suffix.lower() in IMAGE_EXTENSIONS
+
+
+class MemberTooLarge(ValueError):
+    """Imagem de um arquivo zip/tar maior que o limite; vira um erro só dessa imagem no lote."""
+
+
+def extract_batch_images(filename, content_type, fileobj, max_images=None, max_bytes=None):
+    """Retorna a lista de (nome, bytes) de um upload do lote: a própria imagem ou as imagens de um arquivo zip/tar.
+
+    O tamanho descompactado de cada imagem do arquivo é conferido antes da leitura: acima de max_bytes
+    ela entra na lista com um MemberTooLarge no lugar dos bytes (um zip pequeno pode conter gigabytes).
+    A leitura para depois de max_images imagens. Bloqueante - rodar fora do event loop.
+    """
+    name = (filename or '').lower()
+    content_type = content_type or ''
+
+    def checked(member_name, size, read):
+        if max_bytes is not None and size > max_bytes:
+            return member_name, MemberTooLarge(f"Image exceeds {max_bytes} bytes once extracted")
+        return member_name, read()
+
+    if name.endswith('.zip') or content_type in ZIP_CONTENT_TYPES:
+        with zipfile.ZipFile(fileobj) as archive:
+            # ZipExtFile nunca lê além de file_size, então o tamanho declarado é um limite confiável
+            infos = (info for info in archive.infolist() if not info.is_dir() and _is_archive_image(info.filename))
+            return [
+                checked(f"{filename}/{info.filename}", info.file_size, lambda info=info: archive.read(info))
+                for info in itertools.islice(infos, max_images)
+            ]
+
+    if name.endswith(('.tar', '.tar.gz', '.tgz')) or content_type in TAR_CONTENT_TYPES:
+        with tarfile.open(fileobj=fileobj, mode='r:*') as archive:
+            members = (entry for entry in archive if entry.isfile() and _is_archive_image(entry.name))
+            return [
+                checked(f"{filename}/{entry.name}", entry.size, lambda entry=entry: archive.extractfile(entry).read())
+                for entry in itertools.islice(members, max_images)
+            ]
+
+    if not content_type.startswith('image/'):
+        raise ValueError("File must be an image or a zip/tar archive of images")
+    return [(filename, fileobj.read())]
+
+
+def parse_description_text(text, model=ImageDescription):
+    """Converte o texto gerado pelo modelo em ImageDescription (ou no modelo pydantic informado).
+
+    Retorna (descrição, método): 'strict' quando o texto é um JSON válido, 'recovered' quando os campos
+    foram recuperados pelo parser incremental tolerante (JSON truncado, cercas ```json, texto extra ou
+    vírgulas sobrando). Lança ValueError quando nem assim os campos são válidos.
+    """
+    json_str = text.strip()
+    if json_str.startswith('```'):
+        json_str = json_str.split('\n', 1)[-1] if '\n' in json_str else json_str[3:]
+        json_str = json_str.rstrip('`').strip()
+    try:
+        return model.model_validate(json.loads(json_str)), 'strict'
+    except ValueError:
+        pass
+
+    extractor = StreamingFieldExtractor()
+    extractor.feed(text)
+    # ValidationError do pydantic é uma subclasse de ValueError
+    return model.model_validate(extractor.fields), 'recovered'
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import json
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Any, NamedTuple, Optional
+import numpy as np
+from PIL import Image
+import py_config
+from py_prefilter import THUMBNAIL_SIZE
+from py_utils import ImageOptimizer, perceptual_hash
+
+try:
+    import av
+except ImportError:  # Dependência opcional: sem PyAV o endpoint de vídeo responde 501
+    av = None
+
+
+def video_available():
+    return av is not None
+
+
+class SampledFrame(NamedTuple):
+    index: int                     # posição do frame no vídeo (frames decodificados)
+    timestamp: float               # segundos desde o início do vídeo
+    score: Optional[float]         # diferença média para o último frame analisado (None no primeiro)
+    image: Any                     # imagem PIL em tamanho original, entregue ao ImageOptimizer
+
+
+def frame_event(frame, result=None, error=None):
+    """Evento NDJSON da linha do tempo para um frame analisado (result é o ImageDescription serializado)."""
+    return {
+        "event": "frame",
+        "index": frame.index,
+        "timestamp": round(frame.timestamp, 3),
+        "score": None if frame.score is None else round(frame.score, 2),
+        "result": result,
+        "error": error,
+    }
+
+
+def allowed_source(source):
+    """Retorna a source a ser aberta quando ela está em VIDEO_SOURCE_PREFIXES, ou None.
+
+    Caminhos locais são normalizados com realpath antes da comparação (e é o caminho normalizado que
+    é aberto), então "/dev/video/../../etc/passwd" ou um symlink não escapam do prefixo. URLs
+    (rtsp://, http://...) são comparadas como vieram.
+    """
+    if "://" not in source:
+        source = os.path.realpath(source)
+    for prefix in py_config.video_source_prefixes():
+        if "://" not in prefix:
+            # realpath remove a barra final, que faz parte do prefixo ("/videos/" não aceita "/videos2")
+            prefix = os.path.realpath(prefix) + ("/" if prefix.endswith("/") else "")
+        if source.startswith(prefix):
+            return source
+    return None
+
+
+def probe_video(source):
+    """Abre o vídeo só para validar e ler os metadados; levanta ValueError quando não é um vídeo decodificável."""
+    try:
+        with av.open(source, mode="r") as container:
+            if not container.streams.video:
+                raise ValueError("No video stream found")
+            stream = container.streams.video[0]
+            return {
+                "codec": stream.codec_context.name,
+                "width": stream.codec_context.width,
+                "height": stream.codec_context.height,
+                "fps": float(stream.average_rate) if stream.average_rate else None,
+                "duration": float(container.duration / av.time_base) if container.duration else None,
+            }
+    except av.FFmpegError as e:
+        # strerror sem o nome do arquivo: o upload é lido de uma cópia temporária no servidor
+        raise ValueError(f"Invalid video: {e.strerror}") from e
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+
+
+class FrameSampler:
+    """Escolhe quais frames decodificados vão para o modelo.
+
+    - intervalo: um frame a cada interval segundos de vídeo
+    - mudança de cena: diferença média da miniatura para o último frame analisado acima de scene_threshold
+    - deduplicação: amostras do intervalo a até dedupe_distance (hash perceptual) do último analisado são descartadas
+
+    As comparações usam uma miniatura em tons de cinza gerada pelo próprio decoder, então só os frames
+    escolhidos são convertidos para imagem em tamanho original.
+    """
+
+    def __init__(self, interval=None, scene_threshold=None, dedupe_distance=None):
+        self.interval = interval if interval is not None else py_config.VIDEO_SAMPLE_INTERVAL
+        self.scene_threshold = scene_threshold if scene_threshold is not None else py_config.VIDEO_SCENE_THRESHOLD
+        if dedupe_distance is None:
+            dedupe_distance = py_config.NEAR_DUP_THRESHOLD if py_config.VIDEO_DEDUPE else -1
+        self.dedupe_distance = dedupe_distance
+        self.decoded = self.sampled = self.duplicates = self.dropped = 0
+        self._last_time = None
+        self._last_thumb = None
+        self._last_hash = None
+
+    def offer(self, timestamp, thumb):
+        """Recebe a miniatura (uint8) de um frame; retorna (escolhido, score)."""
+        self.decoded += 1
+        current = thumb.astype(np.float32)
+        score = changed = None
+        if self._last_thumb is not None:
+            score = float(np.abs(current - self._last_thumb).mean())
+            due = self.interval > 0 and timestamp - self._last_time >= self.interval
+            changed = self.scene_threshold > 0 and score >= self.scene_threshold
+            if not (due or changed):
+                return False, score
+
+        phash = perceptual_hash(Image.fromarray(thumb))
+        self._last_time = timestamp
+        # Uma mudança de cena sempre passa; a deduplicação só filtra as amostras periódicas
+        if (not changed and self.dedupe_distance >= 0 and self._last_hash is not None
+                and (phash ^ self._last_hash).bit_count() <= self.dedupe_distance):
+            # Mesma cena: o intervalo recomeça, mas a referência continua sendo o último frame analisado
+            self.duplicates += 1
+            return False, score
+
+        self._last_thumb = current
+        self._last_hash = phash
+        self.sampled += 1
+        return True, score
+
+    def stats(self):
+        return {"decoded": self.decoded, "sampled": self.sampled, "duplicates": self.duplicates, "dropped": self.dropped}
+
+
+def sample_frames(source, sampler, keyframes_only=None, max_frames=None):
+    """Gerador (bloqueante) de SampledFrame: decodifica o vídeo e entrega só os frames escolhidos pelo sampler.
+
+    source é um caminho, URL (rtsp://, http://...) ou objeto file-like aceito pelo PyAV.
+    """
+    keyframes_only = keyframes_only if keyframes_only is not None else py_config.VIDEO_KEYFRAMES_ONLY
+    max_frames = max_frames if max_frames is not None else py_config.VIDEO_MAX_FRAMES
+    with av.open(source, mode="r") as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        if keyframes_only:
+            stream.codec_context.skip_frame = "NONKEY"
+        for index, frame in enumerate(container.decode(stream)):
+            timestamp = float(frame.time) if frame.time is not None else index / float(stream.average_rate or 1)
+            thumb = frame.reformat(width=THUMBNAIL_SIZE[0], height=THUMBNAIL_SIZE[1], format="gray").to_ndarray()
+            keep, score = sampler.offer(timestamp, thumb)
+            if keep:
+                yield SampledFrame(index, timestamp, score, frame.to_image())
+                if max_frames and sampler.sampled >= max_frames:
+                    return
+
+
+async def iterate_bounded(frames, buffer=None, sampler=None, live=False):
+    """Consome o gerador bloqueante numa thread, com no máximo buffer frames à frente do consumidor.
+
+    Com o buffer cheio o decode espera (arquivo) ou, com live=True (stream ao vivo, que não pode
+    esperar), o frame é descartado e contado em sampler.dropped. Fechar o gerador para o decode.
+    """
+    items = queue.Queue(maxsize=buffer or py_config.VIDEO_BUFFER_FRAMES)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            with closing(frames):
+                for frame in frames:
+                    if stop.is_set():
+                        return
+                    if live:
+                        try:
+                            items.put_nowait(frame)
+                        except queue.Full:
+                            if sampler is not None:
+                                sampler.dropped += 1
+                    else:
+                        put(frame)
+        except Exception as e:
+            put(e)
+        put(done)
+
+    producer = threading.Thread(target=produce, name="video-decode", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = await asyncio.to_thread(items.get)
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Libera um items.get() que ficou pendente numa thread quando o consumidor é cancelado
+        try:
+            items.put_nowait(done)
+        except queue.Full:
+            pass
+
+
+def main():
+    """Amostra um vídeo ou stream local (arquivo, /dev/video0, rtsp://...) e envia os frames escolhidos para
+    /analyze-image/ da API, imprimindo a linha do tempo em NDJSON (mesmos eventos de /analyze-video/).
+
+    Só os frames amostrados trafegam, já reduzidos pelo ImageOptimizer; o decode espera enquanto
+    --concurrency frames estão em análise.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__.splitlines()[0])
+    parser.add_argument("source")
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--interval", type=float, help="segundos de vídeo entre frames analisados")
+    parser.add_argument("--scene-threshold", type=float, help="diferença média (0-255) que conta como mudança de cena")
+    parser.add_argument("--keyframes-only", action="store_true", default=None)
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--concurrency", type=int, default=py_config.OLLAMA_NUM_PARALLEL)
+    parser.add_argument("--camera-id", help="enviado como X-Camera-Id (pré-filtro de cena inalterada)")
+    args = parser.parse_args()
+
+    import httpx
+    if av is None:
+        raise SystemExit("PyAV is not installed (pip install av)")
+    sampler = FrameSampler(args.interval, args.scene_threshold)
+    optimizer = ImageOptimizer.from_preset(py_config.IMAGE_PRESET)
+    headers = {"X-Camera-Id": args.camera_id} if args.camera_id else {}
+
+    def analyze(client, frame):
+        _, jpeg = optimizer.process(frame.image)
+        response = client.post(f"{args.api.rstrip('/')}/analyze-image/", headers=headers,
+                               files={"file": (f"frame_{frame.index}.jpg", bytes(jpeg), "image/jpeg")})
+        if response.status_code != 200:
+            return frame_event(frame, error=response.json().get("detail", response.text))
+        return frame_event(frame, result=response.json())
+
+    print(json.dumps({"event": "video", **probe_video(args.source)}), flush=True)
+    with httpx.Client(timeout=py_config.OLLAMA_READ_TIMEOUT) as client, ThreadPoolExecutor(args.concurrency) as pool:
+        pending = deque()
+        for frame in sample_frames(args.source, sampler, args.keyframes_only, args.max_frames):
+            pending.append(pool.submit(analyze, client, frame))
+            if len(pending) >= args.concurrency:
+                print(json.dumps(pending.popleft().result(), ensure_ascii=False), flush=True)
+        while pending:
+            print(json.dumps(pending.popleft().result(), ensure_ascii=False), flush=True)
+    print(json.dumps({"event": "done", **sampler.stats()}))
+
+
+if __name__ == "__main__":
+    main()
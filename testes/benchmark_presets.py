@@ -0,0 +1,52 @@
+"""Benchmark dos presets de pré-processamento do ImageOptimizer (fast/balanced/accurate).
+
+Mede o tempo de pré-processamento (decode + resize + encode) e o tamanho do payload enviado ao modelo.
+
+Uso:
+    python testes/benchmark_presets.py [imagens...]
+
+Sem argumentos usa as imagens de testes/guns e testes/ollama_structured_outputs.
+"""
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent / "fastapi"))
+
+from py_utils import IMAGE_PRESETS, ImageOptimizer  # noqa: E402
+
+REPEAT = 20
+
+
+def default_images():
+    images = [ROOT / "guns" / "assalto.jpg", ROOT / "guns" / "image.png", ROOT / "ollama_structured_outputs" / "teste.jpeg"]
+    return [path for path in images if path.exists()]
+
+
+def benchmark(optimizer, data):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        img, payload = optimizer.process(data)
+    elapsed = (time.perf_counter() - start) / REPEAT
+    return elapsed * 1000, len(payload), img.size
+
+
+def main():
+    paths = [Path(p) for p in sys.argv[1:]] or default_images()
+    # O comportamento anterior (800px, LANCZOS, optimize + progressive) como referência
+    optimizers = {"legacy": ImageOptimizer(max_size=800, quality=90)}
+    optimizers.update({name: ImageOptimizer.from_preset(name) for name in IMAGE_PRESETS})
+
+    print(f"{'image':<20} {'preset':<10} {'ms':>8} {'bytes':>9} {'size':>11}")
+    print("-" * 62)
+    for path in paths:
+        data = path.read_bytes()
+        for name, optimizer in optimizers.items():
+            ms, size, dims = benchmark(optimizer, data)
+            print(f"{path.name:<20} {name:<10} {ms:>8.1f} {size:>9} {dims[0]:>5}x{dims[1]:<5}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
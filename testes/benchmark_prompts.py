@@ -0,0 +1,94 @@
+"""Benchmark das variantes de prompt de sistema (py_prompts.PROMPT_VARIANTS): acerto x tempo de prompt eval.
+
+Para cada variante e imagem faz --repeat chamadas iguais ao /api/chat do Ollama. A primeira avalia o
+prompt inteiro; as seguintes mostram o ganho do reaproveitamento do prefixo (KV cache) pelo Ollama.
+Informa prompt_eval_count, tempo de prompt eval (primeira chamada e média das demais), tempo total
+e o acerto de has_weapon/has_people contra os rótulos.
+
+Uso:
+    python testes/benchmark_prompts.py [--url http://localhost:11434] [--model llava:7b] [--labels rotulos.json] [imagens...]
+
+rotulos.json: {"arquivo.jpg": {"has_weapon": true, "has_people": true}, ...}. Sem argumentos usa as
+imagens de testes/ com os rótulos abaixo.
+"""
+import argparse
+import base64
+import json
+import sys
+from pathlib import Path
+import httpx
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent / "fastapi"))
+
+import py_config  # noqa: E402
+from py_prompts import PROMPT_VARIANTS, build_messages, context_size, load_system_prompt  # noqa: E402
+from py_utils import ImageDescription, ImageOptimizer, parse_description_text  # noqa: E402
+
+DEFAULT_LABELS = {
+    "assalto.jpg": {"has_weapon": True, "has_people": True},
+    "image.png": {"has_weapon": True, "has_people": True},
+    "teste.jpeg": {"has_weapon": False, "has_people": False},
+}
+DEFAULT_IMAGES = [ROOT / "guns" / "assalto.jpg", ROOT / "guns" / "image.png", ROOT / "ollama_structured_outputs" / "teste.jpeg"]
+
+
+def chat(client, url, model, system_prompt, image_data, num_ctx):
+    response = client.post(f"{url}/api/chat", json={
+        "model": model,
+        "messages": build_messages(system_prompt, [image_data]),
+        "format": ImageDescription.model_json_schema(),
+        "stream": False,
+        "options": {"num_ctx": num_ctx, "num_predict": py_config.DESCRIPTION_NUM_PREDICT, "temperature": 0.2},
+        "keep_alive": py_config.OLLAMA_KEEP_ALIVE,
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--url", default=py_config.OLLAMA_URL)
+    parser.add_argument("--model", default=py_config.OLLAMA_MODEL)
+    parser.add_argument("--variants", default=",".join(PROMPT_VARIANTS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--labels")
+    args = parser.parse_args()
+
+    paths = [Path(p) for p in args.images] or [p for p in DEFAULT_IMAGES if p.exists()]
+    labels = json.loads(Path(args.labels).read_text()) if args.labels else DEFAULT_LABELS
+    optimizer = ImageOptimizer.from_preset(py_config.IMAGE_PRESET)
+    images = [(path.name, base64.b64encode(optimizer.process(path.read_bytes())[1]).decode()) for path in paths]
+
+    print(f"{'variant':<10} {'image':<14} {'tokens':>6} {'cold ms':>9} {'warm ms':>9} {'total ms':>9} {'correct':>8}")
+    print("-" * 72)
+    with httpx.Client(timeout=py_config.OLLAMA_READ_TIMEOUT) as client:
+        for variant in args.variants.split(","):
+            _, system_prompt = load_system_prompt(variant, path="")
+            num_ctx = context_size((system_prompt,), py_config.DESCRIPTION_NUM_PREDICT)
+            correct = total = 0
+            for name, image_data in images:
+                runs = [chat(client, args.url, args.model, system_prompt, image_data, num_ctx) for _ in range(args.repeat)]
+                cold = runs[0].get("prompt_eval_duration", 0) / 1e6
+                warm = [run.get("prompt_eval_duration", 0) / 1e6 for run in runs[1:]]
+                total_ms = sum(run.get("total_duration", 0) for run in runs) / len(runs) / 1e6
+                mark = "-"
+                if name in labels:
+                    try:
+                        description, _ = parse_description_text(runs[-1]["message"]["content"])
+                        ok = all(getattr(description, key) == value for key, value in labels[name].items())
+                    except ValueError:
+                        ok = False
+                    correct += ok
+                    total += 1
+                    mark = "yes" if ok else "no"
+                warm_ms = f"{sum(warm) / len(warm):>9.1f}" if warm else f"{'-':>9}"
+                print(f"{variant:<10} {name:<14} {runs[0].get('prompt_eval_count', 0):>6} {cold:>9.1f} {warm_ms} {total_ms:>9.1f} {mark:>8}")
+            if total:
+                print(f"{variant:<10} accuracy {correct}/{total} (num_ctx={num_ctx})")
+            print()
+
+
+if __name__ == "__main__":
+    main()
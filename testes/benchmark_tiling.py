@@ -0,0 +1,119 @@
+"""Benchmark de vários frames por chamada (TILE_MODE grid/multi) contra uma chamada por imagem.
+
+Para cada modo envia o corpus ao /api/chat do Ollama em grupos de --tile-size frames (no modo "single",
+uma chamada por frame) e informa o custo por frame (tempo total e de prompt eval), tokens de prompt e
+o acerto de has_weapon/has_people contra os rótulos.
+
+Uso:
+    python testes/benchmark_tiling.py [--url http://localhost:11434] [--model llava:7b] [--tile-size 4] [--labels rotulos.json] [imagens...]
+
+Sem argumentos usa as imagens e rótulos de testes/benchmark_prompts.py, repetidas até formar --frames frames.
+"""
+import argparse
+import base64
+import json
+import sys
+import time
+from pathlib import Path
+import httpx
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent / "fastapi"))
+
+import py_config  # noqa: E402
+from benchmark_prompts import DEFAULT_IMAGES, DEFAULT_LABELS  # noqa: E402
+from py_prompts import TILED_PROMPTS, build_messages, context_size, default_image_tokens, load_system_prompt, tiled_user_prompt  # noqa: E402
+from py_utils import ImageDescription, ImageOptimizer, TileDescriptions, parse_description_text  # noqa: E402
+
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+
+def chat(client, url, model, system_prompt, images, user_prompt, schema, num_ctx, num_predict):
+    start = time.perf_counter()
+    response = client.post(f"{url}/api/chat", json={
+        "model": model,
+        "messages": build_messages(system_prompt, images, user_prompt),
+        "format": schema.model_json_schema(),
+        "stream": False,
+        "options": {"num_ctx": num_ctx, "num_predict": num_predict, "temperature": 0.2},
+        "keep_alive": py_config.OLLAMA_KEEP_ALIVE,
+    })
+    response.raise_for_status()
+    return response.json(), time.perf_counter() - start
+
+
+def run_mode(client, args, mode, frames, optimizer):
+    """Retorna (lista de ImageDescription ou None por frame, segundos, ms de prompt eval, tokens de prompt)."""
+    results, elapsed, prompt_eval, prompt_tokens = [], 0.0, 0.0, 0
+    if mode == "single":
+        _, system_prompt = load_system_prompt()
+        num_ctx = context_size((system_prompt,), py_config.DESCRIPTION_NUM_PREDICT)
+        for _, data in frames:
+            reply, seconds = chat(client, args.url, args.model, system_prompt, [b64(data)], "Imagem:",
+                                  ImageDescription, num_ctx, py_config.DESCRIPTION_NUM_PREDICT)
+            elapsed += seconds
+            prompt_eval += reply.get("prompt_eval_duration", 0) / 1e6
+            prompt_tokens += reply.get("prompt_eval_count", 0)
+            try:
+                results.append(parse_description_text(reply["message"]["content"])[0])
+            except ValueError:
+                results.append(None)
+        return results, elapsed, prompt_eval, prompt_tokens
+
+    num_predict = py_config.TILE_NUM_PREDICT * args.tile_size
+    image_tokens = default_image_tokens() * (args.tile_size if mode == "multi" else 1)
+    num_ctx = context_size((TILED_PROMPTS[mode],), num_predict, image_tokens)
+    for start in range(0, len(frames), args.tile_size):
+        group = [data for _, data in frames[start:start + args.tile_size]]
+        images = [b64(optimizer.compose_grid(group, args.cols)[1])] if mode == "grid" else [b64(data) for data in group]
+        reply, seconds = chat(client, args.url, args.model, TILED_PROMPTS[mode], images, tiled_user_prompt(len(group)),
+                              TileDescriptions, num_ctx, num_predict)
+        elapsed += seconds
+        prompt_eval += reply.get("prompt_eval_duration", 0) / 1e6
+        prompt_tokens += reply.get("prompt_eval_count", 0)
+        try:
+            tiles = {tile.tile: tile for tile in parse_description_text(reply["message"]["content"], TileDescriptions)[0].tiles}
+        except ValueError:
+            tiles = {}
+        results.extend(tiles.get(position) for position in range(len(group)))
+    return results, elapsed, prompt_eval, prompt_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--url", default=py_config.OLLAMA_URL)
+    parser.add_argument("--model", default=py_config.OLLAMA_MODEL)
+    parser.add_argument("--modes", default="single,grid,multi")
+    parser.add_argument("--tile-size", type=int, default=py_config.TILE_SIZE)
+    parser.add_argument("--cols", type=int, default=py_config.TILE_GRID_COLS)
+    parser.add_argument("--frames", type=int, default=8, help="frames por modo (o corpus é repetido)")
+    parser.add_argument("--labels")
+    args = parser.parse_args()
+
+    paths = [Path(p) for p in args.images] or [p for p in DEFAULT_IMAGES if p.exists()]
+    labels = json.loads(Path(args.labels).read_text()) if args.labels else DEFAULT_LABELS
+    optimizer = ImageOptimizer.from_preset(py_config.IMAGE_PRESET)
+    corpus = [(path.name, bytes(optimizer.process(path.read_bytes())[1])) for path in paths]
+    frames = [corpus[i % len(corpus)] for i in range(max(args.frames, len(corpus)))]
+
+    print(f"{'mode':<8} {'frames':>6} {'ms/frame':>9} {'prompt ms/frame':>16} {'prompt tok/frame':>17} {'answered':>9} {'correct':>8}")
+    print("-" * 80)
+    with httpx.Client(timeout=py_config.OLLAMA_READ_TIMEOUT) as client:
+        for mode in args.modes.split(","):
+            results, elapsed, prompt_eval, prompt_tokens = run_mode(client, args, mode, frames, optimizer)
+            answered = sum(result is not None for result in results)
+            correct = sum(
+                result is not None and all(getattr(result, key) == value for key, value in labels[name].items())
+                for (name, _), result in zip(frames, results) if name in labels
+            )
+            labelled = sum(name in labels for name, _ in frames)
+            count = len(frames)
+            print(f"{mode:<8} {count:>6} {elapsed * 1000 / count:>9.1f} {prompt_eval / count:>16.1f} "
+                  f"{prompt_tokens / count:>17.1f} {answered:>4}/{count:<4} {correct:>3}/{labelled:<3}")
+
+
+if __name__ == "__main__":
+    main()
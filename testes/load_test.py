@@ -0,0 +1,260 @@
+"""Gerador de carga para /analyze-image/ (ou outro endpoint de upload).
+
+Envia um corpus de imagens com concorrência fixa (--concurrency, loop fechado) ou a uma taxa fixa
+(--rps, loop aberto) e informa latência p50/p95/p99, throughput, erros por status, a latência de cada
+etapa (lida do header Server-Timing) e o CPU/memória do processo da API (lidos de /metrics).
+
+Uso, sem GPU:
+    python testes/mock_ollama.py --port 11434 &
+    OLLAMA_URL=http://localhost:11434 uvicorn app:app --app-dir fastapi --port 8000 &
+    python testes/load_test.py --concurrency 8 --duration 30 --unique --json resultado.json
+    python testes/load_test.py --rps 5 --duration 30 --unique --baseline resultado.json
+
+--unique gera uma variação perceptualmente diferente por requisição, para não medir só os caches
+(resultado exato e quase-duplicatas).
+--baseline compara com um resultado salvo por --json e mostra a variação de cada número.
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+import httpx
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
+
+
+def default_images():
+    images = [ROOT / "guns" / "assalto.jpg", ROOT / "guns" / "image.png", ROOT / "ollama_structured_outputs" / "teste.jpeg"]
+    return [path for path in images if path.exists()]
+
+
+def load_corpus(paths):
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES))
+        else:
+            files.append(path)
+    return [(path.name, path.read_bytes()) for path in files]
+
+
+def unique_variants(corpus, count):
+    """Gera count variações do corpus que não caem em nenhum cache da API.
+
+    Mudar um pixel muda o hash de conteúdo, mas não o hash perceptual (dHash de uma miniatura 9x8), e o
+    índice de quase-duplicatas responderia a maioria das requisições. Cada variação recebe um recorte
+    aleatório e uma grade 9x8 de tons aleatórios sobreposta, que muda a própria miniatura do dHash.
+    """
+    variants = []
+    for i in range(count):
+        name, data = corpus[i % len(corpus)]
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+        dx, dy = random.randrange(img.width // 10 + 1), random.randrange(img.height // 10 + 1)
+        img = img.crop((dx, dy, dx + img.width * 9 // 10, dy + img.height * 9 // 10))
+        grid = Image.frombytes("L", (9, 8), random.randbytes(72)).resize(img.size, Image.Resampling.NEAREST)
+        img = Image.blend(img, grid.convert("RGB"), 0.4)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=95)
+        variants.append((f"{i}_{Path(name).stem}.jpg", buffer.getvalue()))
+    return variants
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def parse_server_timing(header):
+    stages = {}
+    for match in re.finditer(r"([\w-]+);dur=([\d.]+)", header or ""):
+        stages[match.group(1)] = float(match.group(2)) / 1000
+    return stages
+
+
+async def process_metrics(client, url):
+    """CPU acumulado (s) e memória residente (bytes) do processo da API, via métricas padrão do prometheus_client."""
+    try:
+        text = (await client.get(f"{url}/metrics")).text
+    except httpx.HTTPError:
+        return None
+    values = {}
+    for name in ("process_cpu_seconds_total", "process_resident_memory_bytes"):
+        match = re.search(rf"^{name} ([\d.e+]+)$", text, re.MULTILINE)
+        if match:
+            values[name] = float(match.group(1))
+    return values or None
+
+
+class LoadTest:
+    def __init__(self, client, url, endpoint, corpus, headers):
+        self.client = client
+        self.target = url + endpoint
+        self.corpus = corpus
+        self.headers = headers
+        self.latencies = []
+        self.statuses = Counter()
+        self.stages = defaultdict(list)
+        self.sent = 0
+
+    def next_image(self):
+        image = self.corpus[self.sent % len(self.corpus)]
+        self.sent += 1
+        return image
+
+    async def request(self):
+        name, data = self.next_image()
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(self.target, files={"file": (name, data, "image/jpeg")}, headers=self.headers)
+            await response.aread()
+            status = str(response.status_code)
+            for stage, seconds in parse_server_timing(response.headers.get("server-timing")).items():
+                self.stages[stage].append(seconds)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.statuses[status] += 1
+        if status == "200":
+            self.latencies.append(time.perf_counter() - start)
+
+    async def closed_loop(self, concurrency, deadline, total):
+        async def worker():
+            while time.perf_counter() < deadline and (total is None or self.sent < total):
+                await self.request()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def open_loop(self, rps, deadline, total):
+        tasks = []
+        interval = 1 / rps
+        next_at = time.perf_counter()
+        while time.perf_counter() < deadline and (total is None or len(tasks) < total):
+            tasks.append(asyncio.create_task(self.request()))
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        await asyncio.gather(*tasks)
+
+
+def summarize(test, elapsed, before, after):
+    ok = len(test.latencies)
+    result = {
+        "requests": sum(test.statuses.values()),
+        "ok": ok,
+        "statuses": dict(test.statuses),
+        "elapsed": elapsed,
+        "throughput": ok / elapsed if elapsed else 0.0,
+        "latency": {f"p{p}": percentile(test.latencies, p) for p in (50, 95, 99)},
+        "stages": {
+            stage: {"p50": percentile(values, 50), "p95": percentile(values, 95), "count": len(values)}
+            for stage, values in sorted(test.stages.items())
+        },
+    }
+    result["latency"]["max"] = max(test.latencies, default=0.0)
+    if before and after:
+        cpu = after.get("process_cpu_seconds_total", 0) - before.get("process_cpu_seconds_total", 0)
+        result["server"] = {
+            "cpu_seconds": cpu,
+            "cpu_percent": 100 * cpu / elapsed if elapsed else 0.0,
+            "cpu_ms_per_request": 1000 * cpu / ok if ok else 0.0,
+            "rss_mb": after.get("process_resident_memory_bytes", 0) / 2 ** 20,
+        }
+    return result
+
+
+def delta(value, baseline):
+    if not baseline:
+        return ""
+    return f" ({(value - baseline) / baseline * 100:+.1f}%)"
+
+
+def report(result, baseline=None):
+    baseline = baseline or {}
+    print(f"requests: {result['requests']}  ok: {result['ok']}  statuses: {result['statuses']}")
+    print(f"throughput: {result['throughput']:.2f} req/s{delta(result['throughput'], baseline.get('throughput'))}")
+    for name, seconds in result["latency"].items():
+        print(f"latency {name:<4} {seconds * 1000:>9.1f} ms{delta(seconds, baseline.get('latency', {}).get(name))}")
+    if result["stages"]:
+        print(f"\n{'stage':<20} {'p50 ms':>9} {'p95 ms':>9} {'count':>7}")
+        for stage, stats in result["stages"].items():
+            base = baseline.get("stages", {}).get(stage, {}).get("p50")
+            print(f"{stage:<20} {stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f} {stats['count']:>7}{delta(stats['p50'], base)}")
+    if "server" in result:
+        server, base = result["server"], baseline.get("server", {})
+        print(f"\nserver cpu: {server['cpu_percent']:.1f}% ({server['cpu_ms_per_request']:.1f} ms/request"
+              f"{delta(server['cpu_ms_per_request'], base.get('cpu_ms_per_request'))})  rss: {server['rss_mb']:.1f} MB"
+              f"{delta(server['rss_mb'], base.get('rss_mb'))}")
+
+
+async def run(args):
+    corpus = load_corpus([Path(p) for p in args.images]) if args.images else load_corpus(default_images())
+    if not corpus:
+        raise SystemExit("No images found")
+    total = args.requests
+    if args.unique:
+        # Repetir uma variação cairia no cache exato: a medição termina quando elas acabam
+        count = args.unique_count or args.requests or int(args.duration * (args.rps or args.concurrency * 10))
+        corpus = unique_variants(corpus, count + args.warmup)
+        total = count
+    headers = dict(map(str.strip, header.split(":", 1)) for header in args.header)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        test = LoadTest(client, args.url.rstrip("/"), args.endpoint, corpus, headers)
+        for _ in range(args.warmup):
+            await test.request()
+        test.latencies.clear()
+        test.statuses.clear()
+        test.stages.clear()
+
+        before = await process_metrics(client, args.url.rstrip("/"))
+        start = time.perf_counter()
+        deadline = start + args.duration
+        if args.rps:
+            await test.open_loop(args.rps, deadline, total)
+        else:
+            await test.closed_loop(args.concurrency, deadline, total)
+        elapsed = time.perf_counter() - start
+        if args.unique and elapsed < args.duration and test.sent - args.warmup >= total:
+            print(f"note: the {total} unique images ran out after {elapsed:.1f}s (raise --unique-count)")
+        after = await process_metrics(client, args.url.rstrip("/"))
+
+    return summarize(test, elapsed, before, after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*", help="imagens ou diretórios (padrão: imagens de testes/)")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/analyze-image/")
+    parser.add_argument("--concurrency", type=int, default=4, help="requisições simultâneas (loop fechado)")
+    parser.add_argument("--rps", type=float, help="taxa fixa de requisições por segundo (loop aberto)")
+    parser.add_argument("--duration", type=float, default=30.0, help="duração da medição (s)")
+    parser.add_argument("--requests", type=int, help="para depois de N requisições")
+    parser.add_argument("--warmup", type=int, default=2, help="requisições descartadas antes da medição")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--unique", action="store_true", help="uma imagem diferente por requisição (sem cache)")
+    parser.add_argument("--unique-count", type=int,
+                        help="variações geradas com --unique (padrão: --requests, ou duration x rps ou x concurrency x 10)")
+    parser.add_argument("--header", action="append", default=[], help="header extra, ex. 'X-Camera-Id: cam1'")
+    parser.add_argument("--json", help="salva o resultado neste arquivo")
+    parser.add_argument("--baseline", help="resultado anterior (--json) para comparação")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    report(result, baseline)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
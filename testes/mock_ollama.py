@@ -0,0 +1,144 @@
+"""Servidor Ollama falso para benchmarks e testes de carga sem GPU.
+
+Emula /api/tags, /api/generate e /api/chat (com e sem stream). Cada chamada simula o carregamento do
+modelo (só na primeira vez, ou depois de keep_alive), o prompt eval e a geração de tokens a uma taxa
+fixa, e devolve os mesmos campos de duração que o Ollama real (total_duration, load_duration,
+prompt_eval_count, eval_count, eval_duration...). A resposta é um JSON válido para o schema pedido.
+
+Uso:
+    python testes/mock_ollama.py [--port 11434] [--latency 0.5] [--tokens-per-sec 30] [--parallel 4]
+
+Depois aponte a API para ele: OLLAMA_URL=http://localhost:11434 (ver testes/load_test.py).
+"""
+import argparse
+import asyncio
+import json
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DESCRIPTION = {"has_weapon": False, "has_people": True, "image_context": "Cena simulada pelo servidor de benchmark."}
+
+
+def build_app(model="llava:7b", latency=0.5, load_time=2.0, tokens_per_sec=30.0, prompt_tokens=600, parallel=4):
+    """latency = prompt eval (s); load_time = carregamento do modelo (s); parallel = OLLAMA_NUM_PARALLEL simulado."""
+    app = FastAPI()
+    slots = asyncio.Semaphore(parallel)
+    state = {"loaded": False}
+
+    def answer(payload):
+        schema = payload.get("format")
+        fields = (schema or {}).get("properties") or DESCRIPTION
+        if "tiles" in fields:
+            # Vários frames por chamada: um objeto por quadro ("Quadros: N") ou por imagem enviada
+            message = payload["messages"][-1]
+            count = int(message["content"].split(":")[-1]) if message["content"].startswith("Quadros:") else len(message.get("images", []))
+            answer_json = {"tiles": [{"tile": tile, **DESCRIPTION} for tile in range(count)]}
+        else:
+            answer_json = {key: DESCRIPTION[key] for key in fields if key in DESCRIPTION}
+        text = json.dumps(answer_json, ensure_ascii=False)
+        # Aproximadamente 4 caracteres por token, limitado por num_predict como no Ollama
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+        num_predict = (payload.get("options") or {}).get("num_predict")
+        if num_predict and num_predict > 0:
+            tokens = tokens[:num_predict]
+        return tokens
+
+    async def load():
+        if state["loaded"]:
+            return 0.0
+        await asyncio.sleep(load_time)
+        state["loaded"] = True
+        return load_time
+
+    def durations(load_duration, eval_count, eval_duration, start):
+        return {
+            "done": True,
+            "total_duration": int((time.perf_counter() - start) * 1e9),
+            "load_duration": int(load_duration * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(latency * 1e9),
+            "eval_count": eval_count,
+            "eval_duration": int(eval_duration * 1e9),
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model}]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        payload = await request.json()
+        start = time.perf_counter()
+        load_duration = await load()
+        if payload.get("keep_alive") in (0, "0"):
+            state["loaded"] = False
+        return {"model": payload.get("model"), "response": "", **durations(load_duration, 0, 0.0, start)}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        payload = await request.json()
+        if payload.get("model") != model:
+            return JSONResponse({"error": f"model '{payload.get('model')}' not found"}, status_code=404)
+        tokens = answer(payload)
+
+        async def run(emit=None):
+            start = time.perf_counter()
+            async with slots:
+                load_duration = await load()
+                await asyncio.sleep(latency)
+                eval_start = time.perf_counter()
+                for token in tokens:
+                    await asyncio.sleep(1 / tokens_per_sec)
+                    if emit is not None:
+                        await emit(token)
+                return durations(load_duration, len(tokens), time.perf_counter() - eval_start, start)
+
+        if not payload.get("stream", True):
+            final = await run()
+            return {"model": model, "message": {"role": "assistant", "content": "".join(tokens)}, **final}
+
+        async def stream():
+            queue = asyncio.Queue()
+
+            async def emit(token):
+                await queue.put({"model": model, "message": {"role": "assistant", "content": token}, "done": False})
+
+            async def produce():
+                final = await run(emit)
+                await queue.put({"model": model, "message": {"role": "assistant", "content": ""}, **final})
+
+            task = asyncio.create_task(produce())
+            try:
+                while True:
+                    chunk = await queue.get()
+                    yield json.dumps(chunk) + "\n"
+                    if chunk["done"]:
+                        break
+            finally:
+                task.cancel()
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--model", default="llava:7b")
+    parser.add_argument("--latency", type=float, default=0.5, help="prompt eval por chamada (s)")
+    parser.add_argument("--load-time", type=float, default=2.0, help="carregamento do modelo na primeira chamada (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=30.0, help="taxa de geração de tokens")
+    parser.add_argument("--prompt-tokens", type=int, default=600, help="prompt_eval_count informado")
+    parser.add_argument("--parallel", type=int, default=4, help="chamadas simultâneas (OLLAMA_NUM_PARALLEL)")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = build_app(args.model, args.latency, args.load_time, args.tokens_per_sec, args.prompt_tokens, args.parallel)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()